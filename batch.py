@@ -0,0 +1,244 @@
+"""Ingests many GCP sheets without prompts, one process per sheet.
+
+The manifest is a JSON file:
+
+  {
+    "defaults": {"workers": 4, "prefetch": 2, "staging_budget": "200G"},
+    "sheets": [
+      {"workbook": "delivery1.xlsx", "sheet": "Videos", "columns": {"Unnamed: 7": "notes"}},
+      {"workbook": "delivery2.xlsx", "sheet": "Sheet1", "mock": true}
+    ]
+  }
+
+Each sheet entry may override any default, and --mock overrides every
+entry. "columns" maps sheet headers
+to the header names ingest expects, replacing the console prompts of
+check_cols. Relative workbook paths are resolved against the manifest.
+With "metrics_dir" set, every sheet writes <workbook>-<sheet>.json and
+.prom stage metrics there.
+"""
+import json
+import logging
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from dotenv import load_dotenv
+import main
+from staging import parse_size
+from metrics import metrics
+
+DEFAULTS = {
+  'mntdir': '/mnt',
+  'mounts': {},
+  'mods_dir': None,
+  'columns': {},
+  'workers': 1,
+  'prefetch': 0,
+  'staging_budget': None,
+  'journal': str(main.DEFAULT_JOURNAL_PATH),
+  'sheet_cache': str(main.DEFAULT_SHEET_CACHE),
+  'dirindex': str(main.DEFAULT_CACHE_PATH),
+  'mock': False,
+  'skip_bad_mods': False,
+  # MODS preflight processes per sheet, by default the cpus are split between the sheets
+  'mods_processes': None,
+  'metrics_dir': None,
+  'upload': False,
+  'reconcile': False,
+  'mount_readers': None,
+  'mount_limits': {},
+  'bandwidth': None,
+  'large_file': None,
+  'fixity': [],
+  'fixity_manifest': str(main.DEFAULT_FIXITY_MANIFEST),
+}
+
+LOG_FORMAT = '[%(asctime)s] %(levelname)s [%(processName)s %(module)s-%(funcName)s()::%(lineno)d] %(message)s'
+
+def read_manifest(manifest_path, overrides=None):
+  """Returns one settings dict per sheet, defaults applied. overrides
+  (the command line) win over the sheet entries too."""
+  manifest_path = Path(manifest_path)
+  with open(manifest_path, 'r') as f:
+    manifest = json.load(f)
+  defaults = dict(DEFAULTS)
+  defaults.update(manifest.get('defaults', {}))
+  entries = []
+  for sheet in manifest['sheets']:
+    entry = dict(defaults)
+    entry.update(sheet)
+    entry.update(overrides or {})
+    if 'workbook' not in entry or 'sheet' not in entry:
+      raise ValueError(f"manifest entry needs a workbook and a sheet: {sheet}")
+    entry['workbook'] = str(manifest_path.parent.joinpath(entry['workbook']))
+    entries.append(entry)
+  return entries
+
+def count_planned(data):
+  return sum(
+    1 + len([child for child in item.get('children', []) if child])
+    for item in data if item
+  )
+
+def run_entry(entry):
+  """Plans and ingests one sheet, returns its summary. Runs in a worker process."""
+  load_dotenv()
+  summary = {
+    'workbook': entry['workbook'],
+    'sheet': entry['sheet'],
+    'planned': 0,
+    'succeeded': 0,
+    'failed': [],
+    'error': None,
+    'mock': entry['mock'],
+  }
+  start = time.monotonic()
+  # pool processes are reused, each sheet gets its own stage metrics
+  metrics.reset()
+  try:
+    main.set_mount_dir(entry['mntdir'], entry['mounts'])
+    mods_dir = entry['mods_dir'] or os.environ['MODS_DIR']
+    data = main.plan_sheet(
+      entry['workbook'],
+      entry['sheet'],
+      entry['sheet_cache'],
+      entry['dirindex'],
+      column_map=entry['columns']
+    )
+    summary['planned'] = count_planned(data)
+    if entry['mock']:
+      preflight = main.check_ingestable_for_mods(data, mods_dir, entry['mods_processes'])
+      summary['failed'] = [
+        {'filename': name, 'error': 'missing MODS'} for name in preflight.missing
+      ] + [
+        {'filename': name, 'error': error} for name, error in preflight.invalid.items()
+      ]
+    else:
+      staging_budget = entry['staging_budget']
+      results = main.run_ingest(
+        data,
+        mods_dir,
+        workers=entry['workers'],
+        prefetch=entry['prefetch'],
+        staging_budget=parse_size(staging_budget) if staging_budget else None,
+        journal_path=entry['journal'],
+        skip_bad_mods=entry['skip_bad_mods'],
+        mods_processes=entry['mods_processes'],
+        fixity=entry['fixity'],
+        fixity_manifest_path=entry['fixity_manifest'],
+        upload=entry['upload'],
+        reconcile=entry['reconcile'],
+        mount_readers=entry['mount_readers'],
+        mount_limits=entry['mount_limits'],
+        bandwidth=parse_size(entry['bandwidth']) if entry['bandwidth'] else None,
+        large_file=parse_size(entry['large_file']) if entry['large_file'] else None
+      )
+      summary['succeeded'] = len([result for result in results if not result['error']])
+      summary['failed'] = [
+        {'filename': result['filename'], 'error': result['error']}
+        for result in results if result['error']
+      ]
+  except Exception as e:
+    logging.exception(f"batch entry {entry['workbook']} - {entry['sheet']} failed: {e}")
+    summary['error'] = str(e) or type(e).__name__
+  summary['seconds'] = round(time.monotonic() - start, 3)
+  if entry['metrics_dir']:
+    name = f"{Path(entry['workbook']).stem}-{entry['sheet']}"
+    main.write_metrics(
+      Path(entry['metrics_dir']).joinpath(f'{name}.json'),
+      Path(entry['metrics_dir']).joinpath(f'{name}.prom'),
+      {'workbook': Path(entry['workbook']).name, 'sheet': entry['sheet']}
+    )
+  return summary
+
+def configure_logging(loglevel):
+  logging.basicConfig(
+    level=loglevel,
+    format=LOG_FORMAT,
+    datefmt='%d/%b/%Y %H:%M:%S',
+    handlers=[
+        logging.FileHandler("../gcp_ingest.log"),
+        logging.StreamHandler()
+    ]
+  )
+
+def run_batch(entries, concurrency:int=2, loglevel='INFO'):
+  """Runs every entry in its own process, at most concurrency at once."""
+  concurrency = max(1, concurrency)
+  mods_processes = max(1, (os.cpu_count() or 1) // concurrency)
+  entries = [
+    entry if entry['mods_processes'] else dict(entry, mods_processes=mods_processes)
+    for entry in entries
+  ]
+  summaries = []
+  with ProcessPoolExecutor(
+      max_workers=concurrency,
+      initializer=configure_logging,
+      initargs=(loglevel,)
+    ) as pool:
+    futures = {pool.submit(run_entry, entry): entry for entry in entries}
+    for future in as_completed(futures):
+      entry = futures[future]
+      try:
+        summary = future.result()
+      except Exception as e:
+        # the worker process itself died
+        logging.exception(f"batch entry {entry['workbook']} - {entry['sheet']} crashed: {e}")
+        summary = {
+          'workbook': entry['workbook'], 'sheet': entry['sheet'], 'planned': 0,
+          'succeeded': 0, 'failed': [], 'error': str(e) or type(e).__name__,
+          'mock': entry['mock'], 'seconds': None,
+        }
+      logging.info(f"finished {Path(summary['workbook']).name} - {summary['sheet']}")
+      summaries.append(summary)
+  return summaries
+
+def log_report(summaries):
+  logging.info(f"Batch finished: {len(summaries)} sheet(s)")
+  for summary in summaries:
+    status = 'ERROR ' + summary['error'] if summary['error'] else 'mock' if summary['mock'] else 'ok'
+    logging.info(
+      f"{Path(summary['workbook']).name} - {summary['sheet']}: {summary['planned']} planned, "
+      f"{summary['succeeded']} succeeded, {len(summary['failed'])} failed, "
+      f"{summary['seconds']}s, {status}"
+    )
+    for failure in summary['failed']:
+      logging.warning(f"  failed: {failure['filename']} - {failure['error']}")
+
+def parse_arguments():
+  parser = ArgumentParser(description="ingest every sheet in a manifest, one process per sheet")
+  parser.add_argument('manifest',
+    type=Path,
+    help='JSON manifest of workbooks, sheets and column mappings'
+  )
+  parser.add_argument('--concurrency',
+    type=int,
+    default=2,
+    help='Maximum number of sheets processed at once'
+  )
+  parser.add_argument('--report',
+    type=Path,
+    help='Write the combined summary as JSON to this path'
+  )
+  parser.add_argument('--mock',
+    action='store_true',
+    help='Plan and check every sheet without ingesting'
+  )
+  parser.add_argument("-l", "--log",
+    dest="loglevel",
+    choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+    default='INFO',
+    help="Set the logging level")
+  return parser.parse_args()
+
+if __name__ == '__main__':
+  args = parse_arguments()
+  configure_logging(args.loglevel)
+  entries = read_manifest(args.manifest, {'mock': True} if args.mock else None)
+  summaries = run_batch(entries, args.concurrency, args.loglevel)
+  log_report(summaries)
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(summaries, f, indent=2)
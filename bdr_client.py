@@ -0,0 +1,178 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# methods that are safe to repeat after the request may have reached the server
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+class BDRClient:
+  """Keep-alive HTTP client shared by the ingest and stream scripts.
+
+  Connection failures are retried for every method, read errors and 5xx
+  responses only for idempotent methods, with exponential backoff. POSTs
+  are never repeated once sent, so an ingest can't create duplicates.
+  For the same reason POSTs wait for their response as long as it takes
+  unless post_read_timeout is set: a large upload that timed out may
+  still have created its object. Latency is recorded per endpoint."""
+
+  def __init__(
+      self,
+      pool_size:int=10,
+      connect_timeout:float=10,
+      read_timeout:float=600,
+      post_read_timeout:float=None,
+      retries:int=5,
+      backoff_factor:float=0.5
+    ):
+    self.timeout = (connect_timeout, read_timeout)
+    self.post_timeout = (connect_timeout, post_read_timeout)
+    retry = Retry(
+      total=None,
+      connect=retries,
+      read=retries,
+      status=retries,
+      backoff_factor=backoff_factor,
+      status_forcelist=RETRY_STATUSES,
+      allowed_methods=IDEMPOTENT_METHODS,
+      raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    self.session = requests.Session()
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    self.latency = {}
+    self.lock = threading.Lock()
+
+  @classmethod
+  def from_environment(cls):
+    """Builds a client from the optional HTTP_* settings in .env"""
+    return cls(
+      pool_size=int(os.environ.get('HTTP_POOL_SIZE', 10)),
+      connect_timeout=float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10)),
+      read_timeout=float(os.environ.get('HTTP_READ_TIMEOUT', 600)),
+      post_read_timeout=float(os.environ['HTTP_POST_READ_TIMEOUT']) if os.environ.get('HTTP_POST_READ_TIMEOUT') else None,
+      retries=int(os.environ.get('HTTP_RETRIES', 5)),
+      backoff_factor=float(os.environ.get('HTTP_BACKOFF', 0.5)),
+    )
+
+  def request(self, method:str, url:str, endpoint:str=None, **kwargs):
+    """Sends a request through the pooled session.
+    endpoint names the stats bucket, defaults to the method and url path."""
+    if not endpoint:
+      parts = urlsplit(url)
+      endpoint = f"{method} {parts.netloc}{parts.path}"
+    kwargs.setdefault('timeout', self.post_timeout if method == 'POST' else self.timeout)
+    start = time.monotonic()
+    error = True
+    try:
+      resp = self.session.request(method, url, **kwargs)
+      error = not resp.ok
+      return resp
+    finally:
+      self.record(endpoint, time.monotonic() - start, error)
+
+  def get(self, url, params=None, **kwargs):
+    return self.request('GET', url, params=params, **kwargs)
+
+  def put(self, url, data=None, **kwargs):
+    return self.request('PUT', url, data=data, **kwargs)
+
+  def post(self, url, data=None, files=None, **kwargs):
+    return self.request('POST', url, data=data, files=files, **kwargs)
+
+  def record(self, endpoint:str, seconds:float, error:bool=False):
+    with self.lock:
+      stats = self.latency.setdefault(endpoint, {
+        'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+      })
+      stats['count'] += 1
+      stats['errors'] += int(error)
+      stats['total'] += seconds
+      stats['max'] = max(stats['max'], seconds)
+
+  def stats(self):
+    """Returns per-endpoint count, errors and mean/max latency in seconds."""
+    with self.lock:
+      return {
+        endpoint: {
+          'count': stats['count'],
+          'errors': stats['errors'],
+          'mean': stats['total'] / stats['count'],
+          'max': stats['max'],
+        }
+        for endpoint, stats in self.latency.items()
+      }
+
+  def log_stats(self):
+    for endpoint, stats in sorted(self.stats().items()):
+      logging.info(
+        f"{endpoint}: {stats['count']} calls, {stats['errors']} errors, "
+        f"mean {stats['mean']:.3f}s, max {stats['max']:.3f}s"
+      )
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> BDRClient:
+  """Returns the process-wide client, created on first use."""
+  global _client
+  with _client_lock:
+    if _client is None:
+      _client = BDRClient.from_environment()
+    return _client
+
+class SolrError(RuntimeError):
+  pass
+
+def solr_pages(solr_url:str, params:dict, fl=None, rows:int=500, sort:str='pid asc', client:BDRClient=None):
+  """Yields the 'response' dict of every page of a Solr query, paging
+  with cursorMark so results are never truncated. sort has to include
+  the unique key."""
+  client = client or get_client()
+  params = dict(params)
+  params.update({'rows': rows, 'sort': sort, 'wt': 'json'})
+  if fl:
+    params['fl'] = fl if isinstance(fl, str) else ','.join(fl)
+  cursor = '*'
+  while True:
+    params['cursorMark'] = cursor
+    resp = client.get(solr_url, params=params, endpoint='GET solr')
+    if not resp.ok:
+      raise SolrError(f"Solr query {params.get('q')} failed: {resp.status_code} - {resp.text[:200]}")
+    body = resp.json()
+    yield body['response']
+    next_cursor = body.get('nextCursorMark')
+    if not next_cursor or next_cursor == cursor:
+      return
+    cursor = next_cursor
+
+def solr_docs(solr_url:str, params:dict, fl=None, rows:int=500, sort:str='pid asc', client:BDRClient=None):
+  """Yields every doc matching a Solr query, one page in memory at a time."""
+  for page in solr_pages(solr_url, params, fl, rows, sort, client):
+    yield from page['docs']
+
+class RateLimiter:
+  """Spaces out work shared by many threads to at most rate units per
+  second. Each wait is charged its cost: 1 for a request, the byte count
+  for a read. A call waits until the cost before it had its time."""
+
+  def __init__(self, rate:float=None):
+    self.rate = rate
+    self.next_time = time.monotonic()
+    self.lock = threading.Lock()
+
+  def wait(self, cost:float=1):
+    if not self.rate:
+      return
+    with self.lock:
+      now = time.monotonic()
+      delay = self.next_time - now
+      self.next_time = max(now, self.next_time) + cost / self.rate
+    if delay > 0:
+      time.sleep(delay)
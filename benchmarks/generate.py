@@ -0,0 +1,109 @@
+"""Writes a synthetic GCP delivery: a workbook, the files it points at
+under a fake mount dir, and one MODS file per row.
+
+  python benchmarks/generate.py /tmp/gcp_bench --rows 10000 --fanout 4
+
+Layout of the output dir:
+  bench.xlsx          sheet "Sheet1", headers like a real delivery
+  mnt/<drive>/...     files named in the sheet, use mnt as --mntdir
+  mods/               <identifierFileName>.mods.xml for every row
+"""
+import random
+from argparse import ArgumentParser
+from pathlib import Path
+from openpyxl import Workbook
+
+HEADERS = ['itemTitle', 'identifierFileName', None, None, 'genreAAT', 'pid', 'ingestcomplete']
+GENRES = [
+  'photographs',
+  'videos',
+  'transcriptions (documents)',
+  'translations (documents)',
+]
+MODS_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<mods:mods xmlns:mods="http://www.loc.gov/mods/v3">
+  <mods:titleInfo><mods:title>{title}</mods:title></mods:titleInfo>
+  <mods:identifier type="local">{filename}</mods:identifier>
+</mods:mods>
+"""
+
+def make_rows(rows:int, fanout:int, dirs:int, drives:str='PQ', seed:int=0):
+  """Returns sheet rows: every parent is followed by up to fanout children
+  naming it in the parent column."""
+  rng = random.Random(seed)
+  result = []
+  parent = None
+  for i in range(rows):
+    filename = f'gcp{i:07d}'
+    windows_dir = f'{rng.choice(drives)}:\\bench\\dir{rng.randrange(dirs):04d}'
+    if parent is None or rng.random() < 1 / (fanout + 1):
+      parent = filename
+      genre, parent_cell = 'photographs', ''
+    else:
+      genre, parent_cell = rng.choice(GENRES), parent
+    suffix = '.mp4' if genre == 'videos' else '.pdf'
+    result.append({
+      'itemTitle': f'Item {i}',
+      'identifierFileName': filename,
+      'parent': parent_cell,
+      'filepath': windows_dir,
+      'genreAAT': genre,
+      'suffix': suffix,
+    })
+  return result
+
+def write_workbook(path, rows):
+  workbook = Workbook()
+  sheet = workbook.active
+  sheet.title = 'Sheet1'
+  sheet.append(HEADERS)
+  # the label row check_cols uses to name the unnamed columns
+  sheet.append(['', '', 'parent', 'filepath', '', '', ''])
+  for row in rows:
+    sheet.append([
+      row['itemTitle'], row['identifierFileName'], row['parent'],
+      row['filepath'], row['genreAAT'], '', '',
+    ])
+  workbook.save(path)
+
+def write_files(mntdir:Path, mods_dir:Path, rows, file_size:int):
+  payload = b'\0' * file_size
+  mods_dir.mkdir(parents=True, exist_ok=True)
+  for row in rows:
+    drive, rest = row['filepath'].split(':', 1)
+    directory = mntdir.joinpath(drive.lower(), *[part for part in rest.split('\\') if part])
+    directory.mkdir(parents=True, exist_ok=True)
+    directory.joinpath(row['identifierFileName'] + row['suffix']).write_bytes(payload)
+    mods_dir.joinpath(f"{row['identifierFileName']}.mods.xml").write_text(
+      MODS_TEMPLATE.format(title=row['itemTitle'], filename=row['identifierFileName'])
+    )
+
+def generate(out_dir, rows:int=1000, fanout:int=3, dirs:int=100, file_size:int=4096, seed:int=0):
+  """Writes the delivery into out_dir, returns the paths the runner needs."""
+  out_dir = Path(out_dir)
+  out_dir.mkdir(parents=True, exist_ok=True)
+  sheet_rows = make_rows(rows, fanout, dirs, seed=seed)
+  paths = {
+    'workbook': out_dir.joinpath('bench.xlsx'),
+    'mntdir': out_dir.joinpath('mnt'),
+    'mods_dir': out_dir.joinpath('mods'),
+  }
+  write_workbook(paths['workbook'], sheet_rows)
+  write_files(paths['mntdir'], paths['mods_dir'], sheet_rows, file_size)
+  return paths
+
+def main():
+  parser = ArgumentParser(description=__doc__)
+  parser.add_argument('out_dir', type=Path)
+  parser.add_argument('--rows', type=int, default=1000)
+  parser.add_argument('--fanout', type=int, default=3, help='mean children per parent')
+  parser.add_argument('--dirs', type=int, default=100, help='distinct directories on the fake mounts')
+  parser.add_argument('--file-size', type=int, default=4096, help='bytes per generated file')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+  paths = generate(args.out_dir, args.rows, args.fanout, args.dirs, args.file_size, args.seed)
+  for name, path in paths.items():
+    print(f"{name}: {path}")
+
+if __name__ == '__main__':
+  main()
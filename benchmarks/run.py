@@ -0,0 +1,157 @@
+"""Times the ingest pipeline end to end on a generated delivery, against
+the stub BDR server.
+
+  python benchmarks/run.py --rows 5000 --workers 4 --latency 0.02 --save results.json
+  python benchmarks/run.py --rows 5000 --workers 4 --compare results.json
+
+Every stage reports wall time, rows/sec and the process peak RSS after
+it ran (ru_maxrss only grows, so a stage's own cost is its increase).
+Stages: check_cols, path resolution, make_ingestable, MODS preflight,
+ingest_data and, with --streams, the create_streams parent resolution
+and rels updates.
+"""
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(REPO_DIR.joinpath('benchmarks')))
+import main as ingest_main
+from pathmap import PathTranslator
+from metrics import metrics
+from generate import generate
+from stub_server import StubBDR
+
+def peak_rss_kb():
+  # kilobytes on linux, bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak // 1024 if sys.platform == 'darwin' else peak
+
+def timed(results, name, rows, func, *args, **kwargs):
+  start = time.perf_counter()
+  value = func(*args, **kwargs)
+  seconds = time.perf_counter() - start
+  results[name] = {
+    'seconds': round(seconds, 4),
+    'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+    'peak_rss_kb': peak_rss_kb(),
+  }
+  print(f"{name:>18}: {seconds:8.3f}s {results[name]['rows_per_sec'] or 0:10.1f} rows/s  peak RSS {results[name]['peak_rss_kb'] / 1024:.1f} MiB")
+  return value
+
+def resolve_paths(sheet, mntdir):
+  translator = PathTranslator(mntdir)
+  for row in sheet[1:]:
+    translator.translate(row['filepath'])
+
+def run_streams(stub, parents, workers):
+  # create_streams needs rq and redis, only imported when asked for
+  import create_streams
+  stub.seed_collection(os.environ['COLLECTION_PID'], parents)
+  updates = create_streams.resolve_parent_streams(stub.solr_url, os.environ['COLLECTION_PID'])
+  return create_streams.update_rels(updates, workers=workers)
+
+def git_commit():
+  try:
+    return subprocess.run(
+      ['git', 'rev-parse', '--short', 'HEAD'],
+      cwd=REPO_DIR, capture_output=True, text=True, check=True
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def run(args, work_dir:Path):
+  paths = generate(work_dir, args.rows, args.fanout, args.dirs, args.file_size)
+  stub = StubBDR(latency=args.latency).start()
+  os.environ.update({
+    'COLLECTION_PID': 'bdr:bench',
+    'API_IDENTITY': 'bench',
+    'API_URL': stub.api_url,
+    'OWNER_ID': 'bench',
+    'API_KEY': 'bench',
+    'STAGING_DIR': str(work_dir.joinpath('staging')),
+  })
+  work_dir.joinpath('staging').mkdir(exist_ok=True)
+  results = {}
+  metrics.reset()
+  try:
+    sheet = timed(results, 'check_cols', args.rows, ingest_main.check_cols,
+      paths['workbook'], 'Sheet1', cache_dir=None, column_map={})
+    timed(results, 'path_resolution', args.rows, resolve_paths, sheet, str(paths['mntdir']))
+    ingest_main.set_mount_dir(str(paths['mntdir']))
+    ingest_main.dir_index.cache_path = None
+    data = timed(results, 'make_ingestable', args.rows, ingest_main.make_ingestable, sheet)
+    preflight = timed(results, 'mods_preflight', args.rows,
+      ingest_main.check_ingestable_for_mods, data, paths['mods_dir'], args.mods_processes)
+    ingested = timed(results, 'ingest_data', args.rows, ingest_main.ingest_data,
+      data, paths['mods_dir'], workers=args.workers, prefetch=args.prefetch, mods=preflight,
+      upload=args.upload)
+    failed = [result for result in ingested if result['error']]
+    if failed:
+      print(f"{len(failed)} of {len(ingested)} uploads failed, first: {failed[0]['error']}")
+    if args.streams:
+      timed(results, 'streams', args.streams, run_streams, stub, args.streams, args.workers)
+  finally:
+    stub.stop()
+  return {
+    'commit': git_commit(),
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'params': {key: value for key, value in vars(args).items() if key not in ('save', 'compare', 'work_dir')},
+    'requests': stub.requests,
+    'uploaded_bytes': stub.uploaded_bytes,
+    'stages': results,
+    'metrics': metrics.summary()['stages'],
+  }
+
+def compare(current, previous_path):
+  with open(previous_path, 'r') as f:
+    previous = json.load(f)
+  print(f"compared with {previous.get('commit')} ({previous_path}):")
+  if previous.get('params') != current['params']:
+    print("  warning: parameters differ, timings are not comparable")
+  for name, stage in current['stages'].items():
+    before = previous['stages'].get(name)
+    if not before or not before['seconds']:
+      continue
+    change = (stage['seconds'] - before['seconds']) / before['seconds'] * 100
+    print(f"{name:>18}: {before['seconds']:8.3f}s -> {stage['seconds']:8.3f}s ({change:+.1f}%)")
+
+def main():
+  parser = ArgumentParser(description=__doc__)
+  parser.add_argument('--rows', type=int, default=1000)
+  parser.add_argument('--fanout', type=int, default=3, help='mean children per parent')
+  parser.add_argument('--dirs', type=int, default=100, help='distinct directories on the fake mounts')
+  parser.add_argument('--file-size', type=int, default=4096, help='bytes per generated file')
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds the stub adds to every request')
+  parser.add_argument('--workers', type=int, default=1)
+  parser.add_argument('--prefetch', type=int, default=0)
+  parser.add_argument('--upload', action='store_true', help='stream files in the POST body instead of staging them')
+  parser.add_argument('--mods-processes', type=int, default=None)
+  parser.add_argument('--streams', type=int, default=0, help='parents to seed for the create_streams stage, 0 skips it')
+  parser.add_argument('--work-dir', type=Path, help='keep the generated delivery here instead of a temp dir')
+  parser.add_argument('--save', type=Path, help='write the results as JSON to this path')
+  parser.add_argument('--compare', type=Path, help='results JSON of an earlier run to compare with')
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.WARNING)
+
+  if args.work_dir:
+    result = run(args, args.work_dir)
+  else:
+    with tempfile.TemporaryDirectory(prefix='gcp_bench_') as work_dir:
+      result = run(args, Path(work_dir))
+  if args.compare:
+    compare(result, args.compare)
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,209 @@
+"""Local stand-in for the BDR items API and Solr, for benchmarks.
+
+  python benchmarks/stub_server.py --port 8999 --latency 0.05
+
+Items API (any path not under /solr):
+  POST  creates an object, answers {"pid": ...}; form or multipart bodies
+  PUT   accepts a rels update
+  GET   /<pid> answers the stored object
+Solr (/solr/select): answers cursorMark paged queries over the seeded
+docs, filtering on object_type and the quoted pids of
+rel_is_derivation_of_ssim / rel_is_part_of_ssim terms.
+"""
+import itertools
+import json
+import re
+import threading
+import time
+from argparse import ArgumentParser
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+class StubBDR:
+  """Threaded stub server holding created objects and Solr docs in memory."""
+
+  def __init__(self, host='127.0.0.1', port=0, latency:float=0.0):
+    self.latency = latency
+    self.objects = {}
+    self.solr_docs = []
+    self.counter = itertools.count(1)
+    self.lock = threading.Lock()
+    self.requests = {'GET': 0, 'POST': 0, 'PUT': 0}
+    self.uploaded_bytes = 0
+    self.server = ThreadingHTTPServer((host, port), self.make_handler())
+    self.server.daemon_threads = True
+    self.thread = None
+
+  @property
+  def url(self):
+    host, port = self.server.server_address[:2]
+    return f'http://{host}:{port}'
+
+  @property
+  def api_url(self):
+    return f'{self.url}/api/private/items/'
+
+  @property
+  def solr_url(self):
+    return f'{self.url}/solr/select'
+
+  def start(self):
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def seed_collection(self, collection:str, parents:int, with_streams:bool=True):
+    """Adds parents with one name-matched video child each (and a stream
+    per video) to the Solr docs."""
+    docs = []
+    for i in range(parents):
+      filename = f'video{i:06d}'
+      docs.append({'pid': f'bdr:p{i}', 'identifierFileName': filename,
+        'rel_is_member_of_collection_ssim': [collection], 'object_type': 'item'})
+      docs.append({'pid': f'bdr:v{i}', 'rel_is_part_of_ssim': [f'bdr:p{i}'],
+        'mods_id_filename_ssim': [filename],
+        'rel_is_member_of_collection_ssim': [collection], 'object_type': 'video'})
+      if with_streams:
+        docs.append({'pid': f'bdr:s{i}', 'rel_is_derivation_of_ssim': [f'bdr:v{i}'],
+          'rel_panopto_id_ssi': f'panopto-{i}', 'object_type': 'stream'})
+    with self.lock:
+      self.solr_docs.extend(docs)
+
+  def query_solr(self, params):
+    q = params.get('q', [''])[0]
+    fq = params.get('fq', [''])[0]
+    docs = self.solr_docs
+    match = re.search(r'object_type:(\w+)', q)
+    if match:
+      docs = [doc for doc in docs if doc.get('object_type') == match.group(1)]
+    elif 'rel_is_part_of_ssim' in fq:
+      # top level items
+      docs = [doc for doc in docs if not doc.get('rel_is_part_of_ssim') and doc.get('object_type') == 'item']
+    for field in ('rel_is_derivation_of_ssim', 'rel_is_part_of_ssim'):
+      match = re.search(field + r':\(([^)]*)\)', q)
+      if match:
+        wanted = set(re.findall(r'"([^"]+)"', match.group(1)))
+        docs = [doc for doc in docs if wanted & set(doc.get(field, []))]
+    rows = int(params.get('rows', ['10'])[0])
+    cursor = params.get('cursorMark', ['*'])[0]
+    start = 0 if cursor == '*' else int(cursor)
+    page = docs[start:start + rows]
+    fl = params.get('fl', [''])[0]
+    if fl:
+      fields = fl.split(',')
+      page = [{field: doc[field] for field in fields if field in doc} for doc in page]
+    next_cursor = str(start + len(page)) if page else cursor
+    return {'response': {'numFound': len(docs), 'start': start, 'docs': page}, 'nextCursorMark': next_cursor}
+
+  def make_handler(self):
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+      # headers and body go out in separate writes, don't let Nagle hold the body
+      disable_nagle_algorithm = True
+
+      def log_message(self, *args):
+        pass
+
+      def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+      def count(self, method):
+        if stub.latency:
+          time.sleep(stub.latency)
+        with stub.lock:
+          stub.requests[method] += 1
+
+      def read_form(self):
+        """Returns the form fields, counting uploaded file bytes."""
+        content_type = self.headers.get('Content-Type', '')
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+          body = self.read_chunked()
+        else:
+          body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if content_type.startswith('multipart/form-data'):
+          return self.parse_multipart(content_type, body)
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+      def parse_multipart(self, content_type, body):
+        # split by hand, the email parser is far slower than the client on large files
+        boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+        form = {}
+        for part in body.split(b'--' + boundary)[1:-1]:
+          head, _, value = part[2:-2].partition(b'\r\n\r\n')
+          disposition = BytesParser(policy=HTTP).parsebytes(head + b'\r\n\r\n')['content-disposition']
+          name = disposition.params.get('name')
+          if disposition.params.get('filename'):
+            with stub.lock:
+              stub.uploaded_bytes += len(value)
+            form[name] = f'<{len(value)} bytes>'
+          else:
+            form[name] = value.decode()
+        return form
+
+      def read_chunked(self):
+        body = bytearray()
+        while True:
+          size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+          if size == 0:
+            self.rfile.readline()
+            return bytes(body)
+          body.extend(self.rfile.read(size))
+          self.rfile.readline()
+
+      def do_GET(self):
+        self.count('GET')
+        parts = urlsplit(self.path)
+        if parts.path.startswith('/solr'):
+          return self.reply(200, stub.query_solr(parse_qs(parts.query)))
+        pid = parts.path.rstrip('/').rsplit('/', 1)[-1]
+        obj = stub.objects.get(pid)
+        if obj is None:
+          return self.reply(404, {'error': f'{pid} not found'})
+        return self.reply(200, obj)
+
+      def do_POST(self):
+        self.count('POST')
+        form = self.read_form()
+        pid = f'bdr:stub{next(stub.counter)}'
+        with stub.lock:
+          stub.objects[pid] = {'pid': pid, 'rels': form.get('rels'), 'content_streams': form.get('content_streams')}
+        return self.reply(200, {'pid': pid})
+
+      def do_PUT(self):
+        self.count('PUT')
+        form = self.read_form()
+        return self.reply(200, {'pid': form.get('pid')})
+
+    return Handler
+
+def main():
+  parser = ArgumentParser(description=__doc__)
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8999)
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+  parser.add_argument('--seed-parents', type=int, default=0, help='parents with video and stream to seed into Solr')
+  parser.add_argument('--collection', default='bdr:bench')
+  args = parser.parse_args()
+  stub = StubBDR(args.host, args.port, args.latency)
+  stub.seed_collection(args.collection, args.seed_parents)
+  print(f"items API at {stub.api_url}, Solr at {stub.solr_url}")
+  try:
+    stub.server.serve_forever()
+  except KeyboardInterrupt:
+    stub.stop()
+
+if __name__ == '__main__':
+  main()
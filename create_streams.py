@@ -1,9 +1,12 @@
 import argparse
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rq import Queue
+from rq.job import Job, JobStatus
 from redis import Redis
-import requests
+from bdr_client import get_client, solr_pages, solr_docs, SolrError, RateLimiter
 from dotenv import load_dotenv
 
 class ResponseError(RuntimeError):
@@ -17,34 +20,75 @@ def check_response(resp,message):
         raise ResponseError(f"{message} - No response")
     return response
 
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+STREAM_QUEUE = 'stream_objects'
+STREAM_FUNCTION = 'stream_objects.create'
+STREAM_JOB_TIMEOUT = 72000
+
+_redis = None
+
+def get_redis():
+    # one connection for every job queued by this process
+    global _redis
+    if _redis is None:
+        _redis = Redis()
+    return _redis
+
 def queue_job(queue_name, function_name, function_args=None, function_kwargs=None):
     function_args = function_args or []
     function_kwargs = function_kwargs or {}
-    q = Queue(queue_name, connection=Redis())
-    return q.enqueue_call(func=function_name, args=function_args, kwargs=function_kwargs, timeout=72000)
+    q = Queue(queue_name, connection=get_redis())
+    return q.enqueue_call(func=function_name, args=function_args, kwargs=function_kwargs, timeout=STREAM_JOB_TIMEOUT)
 
 def queue_create_stream_job(pid, datastream_or_url=None, visibility="public"):
     kwargs={'visibility': visibility}
     if datastream_or_url:
         kwargs['datastream_or_url'] = datastream_or_url
-    return queue_job(queue_name='stream_objects', function_name='stream_objects.create', function_args=(pid,), function_kwargs=kwargs)
+    return queue_job(queue_name=STREAM_QUEUE, function_name=STREAM_FUNCTION, function_args=(pid,), function_kwargs=kwargs)
+
+def queue_create_stream_jobs(pids, visibility="public", batch_size=100, result_ttl=None):
+    # enqueue stream jobs in pipelined batches over one connection, returns the jobs
+    # result_ttl keeps finished jobs around for callers polling their status (rq defaults to 500s)
+    q = Queue(STREAM_QUEUE, connection=get_redis())
+    kwargs = {'visibility': visibility}
+    jobs = []
+    for batch in chunks(list(pids),batch_size):
+        with q.connection.pipeline() as pipe:
+            if hasattr(q,'enqueue_many'):
+                # rq >= 1.9
+                job_datas = [
+                    Queue.prepare_data(STREAM_FUNCTION,args=(pid,),kwargs=kwargs,timeout=STREAM_JOB_TIMEOUT,result_ttl=result_ttl)
+                    for pid in batch
+                ]
+                jobs.extend(q.enqueue_many(job_datas,pipeline=pipe))
+            else:
+                batch_jobs = [
+                    q.create_job(STREAM_FUNCTION,args=(pid,),kwargs=kwargs,timeout=STREAM_JOB_TIMEOUT,result_ttl=result_ttl)
+                    for pid in batch
+                ]
+                for job in batch_jobs:
+                    q.enqueue_job(job,pipeline=pipe)
+                jobs.extend(batch_jobs)
+            pipe.execute()
+        print(f"queued {len(jobs)} stream jobs")
+    return jobs
 
-def get_top_level_items(api_url,collection):
-    # Select every top level item from collection, up to 9999
+def get_top_level_items(api_url,collection,fl=("pid","identifierFileName")):
+    # Yield every top level item from collection, paging through solr
     params = {
         "q":f"rel_is_member_of_collection_ssim:{collection}",
         "fq":"!rel_is_part_of_ssim:['' TO *]",
-        "rows":9999
     }
-    response = requests.get(api_url,params)
-    if not response.ok:
-        print(f"Response not ok: {response.status_code} - {response.headers}")
-        return
-    print(f'found {response.json()["response"]["numFound"]} items...')
-    return response.json()["response"]["docs"]
+    for i, page in enumerate(solr_pages(api_url,params,fl=fl)):
+        if i == 0:
+            print(f'found {page["numFound"]} items...')
+        yield from page["docs"]
 
 def get_child_with_filename(api_url,pid,filename):
-    resp = requests.get(api_url,params={
+    resp = get_client().get(api_url,params={
         "q":f'rel_is_part_of_ssim:{pid} \
             mods_id_filename_ssim:{filename} \
             object_type:video'
@@ -61,7 +105,7 @@ def get_child_with_filename(api_url,pid,filename):
     return item
 
 def select_stream_from_item_pid(api_url,pid):
-    resp = requests.get(api_url,params={
+    resp = get_client().get(api_url,params={
         "q":f"rel_is_derivation_of_ssim:{pid} object_type:stream"
     })
     response = check_response(resp,f"{pid} stream")
@@ -79,46 +123,233 @@ def add_stream_to_rels(pid, panoptoId):
     }
     # TODO: add stream cmodel to rels... seems to need xml, see link:
     # https://github.com/Brown-University-Library/bdr_apis_project/blob/0f176eb800ca7c31b45822f291e69784d14153f7/items_app/metadata.py#L837
-    r = requests.put(os.environ["API_URL"],data=params)
+    r = get_client().put(os.environ["API_URL"],data=params)
     if not r.ok:
         raise Exception(f'{r.status_code} - {r.text}')
 
 def get_stream_id(pid,api_url):
-    resp=requests.get(api_url+pid)
+    resp=get_client().get(api_url+pid,endpoint="GET item")
     item = resp.json()
     stream_obj = item['relations']['hasDerivation'][0]
-    resp_s=requests.get(api_url+stream_obj['pid'])
+    resp_s=get_client().get(api_url+stream_obj['pid'],endpoint="GET item")
     item_s = resp_s.json()
     panopto_id = item_s.get('rel_panopto_id_ssi')
     return panopto_id
 
-def gcp_make_streams(api_url,collection):
-    # create stream for all videos in collection
-    resp = requests.get(api_url,params={
+def gcp_make_streams(api_url,collection,skip_streamed=True,result_ttl=None,raise_errors=False):
+    # create stream for all videos in collection that don't have one yet
+    # a failed solr query queues nothing, and is raised with raise_errors
+    params = {
         "q":f"rel_is_member_of_collection_ssim:{collection} object_type:video",
-        "rows":999
-    })
+    }
     try:
-        response = check_response(resp,"videos query")
-    except ResponseError:
-        print("Error on main query")
-        return
-    print(f"found {response['numFound']} items")
+        pids = list(dict.fromkeys(doc['pid'] for doc in solr_docs(api_url,params,fl="pid")))
+        print(f"found {len(pids)} items")
+        if skip_streamed:
+            streamed = get_streams_for_items(api_url,pids)
+            pids = [pid for pid in pids if pid not in streamed]
+            print(f"{len(streamed)} already have a stream, {len(pids)} to queue")
+    except SolrError as e:
+        print(f"Error on main query: {e}")
+        if raise_errors:
+            raise
+        return []
+    return queue_create_stream_jobs(pids,result_ttl=result_ttl)
 
-    for doc in response['docs']:
-        print(f"queueing job for {doc['pid']}")
-        queue_create_stream_job(doc['pid'])
+def solr_or_terms(values):
+    return " OR ".join('"'+str(value).replace('"','\\"')+'"' for value in values)
 
-def gcp_attach_streams_to_parents(api_url,collection,item_api):
-    # for all parent items, attach stream id of name-matched item to parent item
-    parents = get_top_level_items(api_url,collection)
+def get_video_children(api_url,collection):
+    # (parent pid, filename) -> child pids, for every video in the collection
+    children = {}
+    params = {"q":f"rel_is_member_of_collection_ssim:{collection} object_type:video"}
+    for doc in solr_docs(api_url,params,fl="pid,rel_is_part_of_ssim,mods_id_filename_ssim"):
+        for parent_pid in doc.get("rel_is_part_of_ssim",[]):
+            for filename in doc.get("mods_id_filename_ssim",[]):
+                children.setdefault((parent_pid,filename),[]).append(doc["pid"])
+    return children
+
+def get_streams_for_items(api_url,pids,batch_size=100):
+    # item pid -> stream docs, fetched in batches of pids
+    streams = {}
+    for batch in chunks(list(pids),batch_size):
+        params = {"q":f"object_type:stream rel_is_derivation_of_ssim:({solr_or_terms(batch)})"}
+        for doc in solr_docs(api_url,params,fl="pid,rel_is_derivation_of_ssim,rel_panopto_id_ssi"):
+            for item_pid in doc.get("rel_is_derivation_of_ssim",[]):
+                streams.setdefault(item_pid,[]).append(doc)
+    return streams
+
+def match_parents_to_children(api_url,collection,failures=None):
+    # parent pid -> (name-matched video child pid, current panopto id of the parent)
+    # parents without exactly one match are appended to failures when given
+    parents = list(get_top_level_items(api_url,collection,fl=("pid","identifierFileName","rel_panopto_id_ssi")))
+    children = get_video_children(api_url,collection)
+    print(f"found {sum(len(pids) for pids in children.values())} video children")
+    matched = {}
     for parent in parents:
         pid = parent['pid']
-        filename = parent['identifierFileName']
-        matched_child = get_child_with_filename(api_url,pid,filename)
-        panoptoId = get_stream_id(matched_child['pid'],item_api)
+        filename = parent.get('identifierFileName')
+        child_pids = children.get((pid,filename),[])
+        if len(child_pids) != 1:
+            print(f'{len(child_pids)} matching children found for {pid} - {filename}: {child_pids}')
+            if failures is not None:
+                failures.append({'pid':pid,'error':f"{len(child_pids)} video children named {filename}"})
+            continue
+        matched[pid] = (child_pids[0],parent.get('rel_panopto_id_ssi'))
+    return matched
+
+def get_panopto_updates(api_url,matched,failures=None):
+    # returns [(parent pid, panopto id, current panopto id)] for the matched parents whose stream is ready
+    # the others are appended to failures when given
+    streams = get_streams_for_items(api_url,{child_pid for child_pid, _ in matched.values()})
+    resolved = []
+    for pid, (child_pid, current) in matched.items():
+        stream_docs = streams.get(child_pid,[])
+        if not stream_docs:
+            print(f"no stream found for {child_pid} (parent {pid})")
+            if failures is not None:
+                failures.append({'pid':pid,'error':f"no stream found for {child_pid}"})
+            continue
+        if len(stream_docs) != 1:
+            print(f"more than one stream found for {child_pid}, using {stream_docs[0]['pid']}")
+        panoptoId = stream_docs[0].get('rel_panopto_id_ssi')
+        if not panoptoId:
+            print(f"stream {stream_docs[0]['pid']} has no panopto id yet (parent {pid})")
+            if failures is not None:
+                failures.append({'pid':pid,'error':f"stream {stream_docs[0]['pid']} has no panopto id yet"})
+            continue
+        resolved.append((pid,panoptoId,current))
+    return resolved
+
+def resolve_parent_streams(api_url,collection,failures=None):
+    # returns [(parent pid, panopto id, current panopto id)] with bulk solr queries instead of 3 calls per parent
+    return get_panopto_updates(api_url,match_parents_to_children(api_url,collection,failures),failures)
+
+def update_rels(updates,workers=4,rate=None,dry_run=False):
+    # PUT panopto ids to parents concurrently, at most rate PUTs per second
+    # returns a report instead of stopping at the first failure
+    report = {'updated':[],'unchanged':[],'failed':[],'dry_run':dry_run}
+    todo = []
+    for pid, panoptoId, current in updates:
+        if current == panoptoId:
+            report['unchanged'].append(pid)
+        elif dry_run:
+            print(f"would set panopto_id of {pid}: {current} -> {panoptoId}")
+            report['updated'].append(pid)
+        else:
+            todo.append((pid,panoptoId))
+    if not todo:
+        return report
+
+    limiter = RateLimiter(rate)
+    def update(pid,panoptoId):
+        limiter.wait()
         add_stream_to_rels(pid,panoptoId)
 
+    with ThreadPoolExecutor(max_workers=max(1,workers)) as pool:
+        futures = {pool.submit(update,pid,panoptoId):pid for pid, panoptoId in todo}
+        for i, future in enumerate(as_completed(futures),1):
+            pid = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"failed to update {pid}: {e}")
+                report['failed'].append({'pid':pid,'error':str(e)})
+            else:
+                report['updated'].append(pid)
+            if i % 100 == 0:
+                print(f"{i}/{len(todo)} parents updated")
+    return report
+
+def print_report(report):
+    verb = "would update" if report['dry_run'] else "updated"
+    print(f"{verb} {len(report['updated'])}, unchanged {len(report['unchanged'])}, failed {len(report['failed'])}")
+    for failure in report['failed']:
+        print(f"  {failure['pid']}: {failure['error']}")
+
+def gcp_attach_streams_to_parents(api_url,collection,item_api,batched=True,workers=4,rate=None,dry_run=False):
+    # for all parent items, attach stream id of name-matched item to parent item
+    # per-parent lookups that failed, reported with the failed updates
+    failed = []
+    if batched:
+        updates = resolve_parent_streams(api_url,collection,failed)
+    else:
+        updates = []
+        parents = get_top_level_items(api_url,collection)
+        for parent in parents:
+            pid = parent['pid']
+            try:
+                filename = parent['identifierFileName']
+                matched_child = get_child_with_filename(api_url,pid,filename)
+                if not matched_child:
+                    raise LookupError(f"no single video child named {filename}")
+                panoptoId = get_stream_id(matched_child['pid'],item_api)
+                if not panoptoId:
+                    raise LookupError(f"stream of {matched_child['pid']} has no panopto id yet")
+            except Exception as e:
+                print(f"failed to look up the stream of {pid}: {e}")
+                failed.append({'pid':pid,'error':str(e) or type(e).__name__})
+                continue
+            updates.append((pid,panoptoId,None))
+    report = update_rels(updates,workers,rate,dry_run)
+    report['failed'].extend(failed)
+    print_report(report)
+    return report
+
+def gcp_stream_and_attach(api_url,collection,workers=4,rate=None,dry_run=False,timeout=86400,poll_interval=60):
+    # queue stream jobs, then attach each parent's panopto id as soon as its child's stream is done
+    matched = match_parents_to_children(api_url,collection)
+    # finished jobs must outlive the wait, or their status is gone before it is polled
+    # without the query behind the jobs every child would look streamed already, stop here
+    jobs = [] if dry_run else gcp_make_streams(api_url,collection,result_ttl=int(timeout + 2 * poll_interval),raise_errors=True)
+    job_ids = {job.id:job.args[0] for job in jobs}
+    # child pid -> parent pid, for parents still waiting for a panopto id
+    waiting = {child_pid:pid for pid, (child_pid, _) in matched.items()}
+    queued = set(job_ids.values())
+    # children without a job of ours already have a stream
+    ready = {child_pid for child_pid in waiting if child_pid not in queued}
+    report = {'updated':[],'unchanged':[],'failed':[],'dry_run':dry_run}
+    start = time.monotonic()
+
+    while True:
+        if ready:
+            batch = {waiting[child_pid]:matched[waiting[child_pid]] for child_pid in ready}
+            updates = get_panopto_updates(api_url,batch)
+            result = update_rels(updates,workers,rate,dry_run)
+            for key in ('updated','unchanged','failed'):
+                report[key].extend(result[key])
+            for pid, _, _ in updates:
+                del waiting[matched[pid][0]]
+            # streams without a panopto id yet stay ready and are tried again next poll
+            ready &= set(waiting)
+
+        if job_ids:
+            for job_id, job in zip(list(job_ids),Job.fetch_many(list(job_ids),connection=get_redis())):
+                # an expired job leaves no status behind, the stream lookup decides
+                status = job.get_status() if job else None
+                if status is None or status == JobStatus.FINISHED:
+                    child_pid = job_ids.pop(job_id)
+                    if child_pid in waiting:
+                        ready.add(child_pid)
+                elif status == JobStatus.FAILED:
+                    child_pid = job_ids.pop(job_id)
+                    report['failed'].append({'pid':waiting.pop(child_pid,child_pid),'error':f"stream job {job_id} failed"})
+
+        print(
+            f"[{int(time.monotonic() - start)}s] streams pending {len(job_ids)}, "
+            f"attached {len(report['updated'])}, waiting {len(waiting)}, failed {len(report['failed'])}"
+        )
+        if dry_run or not waiting or (not job_ids and not ready):
+            break
+        if time.monotonic() - start > timeout:
+            print(f"timed out after {timeout}s with {len(waiting)} parents still waiting")
+            for child_pid, pid in waiting.items():
+                report['failed'].append({'pid':pid,'error':f"timed out waiting for stream of {child_pid}"})
+            break
+        time.sleep(poll_interval)
+    print_report(report)
+    return report
+
 def main():
     load_dotenv()
     api_url = os.environ["SOLR_URL"]
@@ -139,20 +370,66 @@ def main():
         help="add stream IDs to parents in GCP collection",
         dest='add'
     )
+    parser.add_argument("--requeue-streamed",
+        action="store_false",
+        help="also queue stream jobs for videos that already have a stream",
+        dest='skip_streamed'
+    )
+    parser.add_argument("--no-batch",
+        action="store_false",
+        help="look up each parent's child and stream one by one instead of in bulk queries",
+        dest='batched'
+    )
+    parser.add_argument("-w","--workers",
+        type=int,
+        default=4,
+        help="number of concurrent rels updates"
+    )
+    parser.add_argument("--rate",
+        type=float,
+        default=5.0,
+        help="maximum rels updates per second sent to the API"
+    )
+    parser.add_argument("-n","--dry-run",
+        action="store_true",
+        help="show the panopto ids that would change without updating anything"
+    )
+    parser.add_argument("--timeout",
+        type=float,
+        default=86400,
+        help="seconds to wait for stream jobs when queueing and attaching together"
+    )
+    parser.add_argument("--poll-interval",
+        type=float,
+        default=60,
+        help="seconds between stream job status checks"
+    )
+    parser.add_argument("--report",
+        help="write the attach report as JSON to this path"
+    )
 
     args = parser.parse_args()
 
     if args.queue and args.add:
-        print("can't make streams and add to parent at once, please allow time for stream generation")
-        parser.print_help()
+        print("queueing jobs and attaching streams to parents as they finish")
+        report = gcp_stream_and_attach(api_url,collection,args.workers,args.rate,args.dry_run,args.timeout,args.poll_interval)
+        if args.report:
+            with open(args.report,'w') as f:
+                json.dump(report,f,indent=2)
+        get_client().log_stats()
         return
     if args.queue:
         print("queueing jobs for full gcp collection")
-        gcp_make_streams(api_url,collection)
+        gcp_make_streams(api_url,collection,args.skip_streamed)
+        get_client().log_stats()
         return
     if args.add:
         print("attaching streams to parents for full gcp collection")
-        gcp_attach_streams_to_parents(api_url,collection,item_api)
+        report = gcp_attach_streams_to_parents(api_url,collection,item_api,args.batched,args.workers,args.rate,args.dry_run)
+        if args.report:
+            with open(args.report,'w') as f:
+                json.dump(report,f,indent=2)
+        get_client().log_stats()
         return
     parser.print_help()
 
@@ -0,0 +1,139 @@
+import fcntl
+import json
+import logging
+import os
+import stat
+from contextlib import contextmanager
+from pathlib import Path
+from metrics import atomic_open
+
+DEFAULT_CACHE_PATH = Path.home().joinpath('.cache', 'gcp_ingest', 'dirindex.json')
+INDEX_VERSION = 1
+
+class DirIndex:
+  """Directory listings keyed by file stem and full name.
+
+  Each directory is listed with a single os.scandir and the listing is
+  persisted to disk. A persisted listing is reused as long as the
+  directory mtime is unchanged, so repeated runs against the same share
+  only stat each directory once. Several processes may share one index
+  file, saves are serialized with a lock file and merge what the others
+  saved in the meantime."""
+
+  def __init__(self, cache_path=DEFAULT_CACHE_PATH):
+    self.cache_path = Path(cache_path) if cache_path else None
+    self.dirs = {}
+    # directories already validated during this run
+    self.checked = {}
+    self.dirty = False
+
+  def read(self):
+    """Returns the persisted listings, {} if there are none usable."""
+    if not self.cache_path or not self.cache_path.exists():
+      return {}
+    try:
+      with open(self.cache_path, 'r') as f:
+        stored = json.load(f)
+    except (OSError, ValueError) as e:
+      logging.warning(f"Could not read directory index {self.cache_path}: {e}")
+      return {}
+    if stored.get('version') != INDEX_VERSION:
+      logging.info(f"Ignoring directory index {self.cache_path} with old version")
+      return {}
+    return stored['dirs']
+
+  def load(self):
+    for dirpath, entry in self.read().items():
+      self.dirs[dirpath] = self._make_entry(entry['mtime_ns'], entry['names'])
+    logging.debug(f"Loaded {len(self.dirs)} directory listings from {self.cache_path}")
+
+  @contextmanager
+  def locked(self):
+    with open(self.cache_path.with_name(f'{self.cache_path.name}.lock'), 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+  def save(self):
+    if not self.cache_path or not self.dirty:
+      return
+    self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with self.locked():
+      # keep the listings other processes saved since we loaded
+      dirs = self.read()
+      dirs.update({
+        dirpath: {'mtime_ns': entry['mtime_ns'], 'names': entry['names']}
+        for dirpath, entry in self.dirs.items()
+      })
+      with atomic_open(self.cache_path) as f:
+        json.dump({'version': INDEX_VERSION, 'dirs': dirs}, f)
+    self.dirty = False
+    logging.debug(f"Saved {len(dirs)} directory listings to {self.cache_path}")
+
+  @staticmethod
+  def _make_entry(mtime_ns, names):
+    stems = {}
+    for name in names:
+      stems.setdefault(Path(name).stem, []).append(name)
+    return {
+      'mtime_ns': mtime_ns,
+      'names': names,
+      'name_set': set(names),
+      'stems': stems,
+    }
+
+  def _scan(self, dirpath:str, mtime_ns:int):
+    logging.debug(f"Listing directory {dirpath}")
+    with os.scandir(dirpath) as it:
+      names = [entry.name for entry in it]
+    entry = self._make_entry(mtime_ns, names)
+    self.dirs[dirpath] = entry
+    self.checked[dirpath] = True
+    self.dirty = True
+    return entry
+
+  def listing(self, dirpath, rescan=False):
+    """Returns the index entry for dirpath.
+    Raises FileNotFoundError or NotADirectoryError like os.scandir."""
+    dirpath = str(dirpath)
+    if dirpath in self.checked and not rescan:
+      return self.dirs[dirpath]
+
+    st = os.stat(dirpath)
+    if not stat.S_ISDIR(st.st_mode):
+      raise NotADirectoryError(dirpath)
+    entry = self.dirs.get(dirpath)
+    if rescan or not entry or entry['mtime_ns'] != st.st_mtime_ns:
+      return self._scan(dirpath, st.st_mtime_ns)
+    # persisted listing is still valid, but may be rescanned once on a miss
+    self.checked[dirpath] = False
+    return entry
+
+  def find(self, dirpath, filename:str, allowed_streams=()):
+    """Returns the files in dirpath matching filename.
+    An exact name match wins, otherwise files whose stem matches and whose
+    suffix is in allowed_streams are returned."""
+    dirpath = str(dirpath)
+    entry = self.listing(dirpath)
+    files = self._match(entry, dirpath, filename, allowed_streams)
+    if not files and self.checked[dirpath] is False:
+      # listing came from disk, make sure the miss isn't a stale listing
+      entry = self.listing(dirpath, rescan=True)
+      files = self._match(entry, dirpath, filename, allowed_streams)
+    return files
+
+  @staticmethod
+  def _match(entry, dirpath:str, filename:str, allowed_streams=()):
+    if filename in entry['name_set']:
+      return [Path(dirpath, filename)]
+    files = []
+    for name in entry['stems'].get(filename, []):
+      file = Path(dirpath, name)
+      if allowed_streams and file.suffix.lower() not in allowed_streams:
+        logging.debug(f"Skipping {file.suffix[1:].upper()} file {file.name}")
+        continue
+      logging.debug(f"Found {file.suffix[1:].upper()} file {file.name}")
+      files.append(file)
+    return files
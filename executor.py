@@ -0,0 +1,241 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from ingest import ingest_files, IngestContext
+from staging import StagedFile, StagingBudget
+from journal import PARENT, CHILD
+from scheduler import ChildScheduler
+
+class IngestExecutor:
+  """Ingests parented data with a thread pool.
+
+  Each parent object is created before any of its children is submitted,
+  children of the same parent (and pid-resumed children) run
+  concurrently. A failed item is recorded and its siblings carry on; the
+  children of a failed parent are skipped.
+
+  With prefetch > 0 child files are staged by a separate pool of prefetch
+  threads while earlier POSTs are in flight, bounded by staging_budget
+  bytes. Each staged copy is deleted as soon as its POST returns.
+
+  With a journal, items posted by an earlier run are skipped and their
+  pids are reused as parents.
+
+  Waiting children are started by a ChildScheduler: by age, within the
+  read caps of their mounts, with large and small files interleaved when
+  it has a large_file size.
+  Up to lookahead children are queued ahead of the running ones to pick
+  from."""
+
+  def __init__(
+      self,
+      mods_dir,
+      allowed_streams:dict,
+      workers:int=1,
+      prefetch:int=0,
+      staging_budget:int=None,
+      journal=None,
+      context:IngestContext=None,
+      scheduler:ChildScheduler=None
+    ):
+    self.mods_dir = Path(mods_dir)
+    self.allowed_streams = allowed_streams
+    self.workers = max(1, workers)
+    self.context = context or IngestContext.from_environment()
+    # uploads read straight from the source, there is nothing to prefetch
+    self.prefetch = 0 if self.context.upload else max(0, prefetch)
+    self.budget = StagingBudget(staging_budget)
+    self.journal = journal
+    self.scheduler = scheduler or ChildScheduler(large_slots=max(1, self.workers // 2))
+    self.lookahead = self.workers * 4
+    self.results = []
+
+  def mods_path(self, filename):
+    return self.mods_dir.joinpath(f'{filename.strip()}.mods.xml')
+
+  def resumed_pid(self, item, role:str):
+    if not self.journal:
+      return None
+    pid = self.journal.posted_pid(item['filename'], role)
+    if pid:
+      logging.info(f'{role} {item["filename"]} already ingested as {pid}, skipping')
+    return pid
+
+  def posted(self, item, role:str, pid):
+    if self.journal and pid:
+      self.journal.mark_posted(item['filename'], role, pid)
+    return pid
+
+  def ingest_parent(self, item):
+    pid = self.resumed_pid(item, PARENT)
+    if pid:
+      return pid
+    logging.info(f'Ingesting parent item {item["filename"]}')
+    pid = ingest_files(
+      self.mods_path(item['filename']),
+      item['filepath'],
+      self.allowed_streams,
+      context=self.context
+    )
+    logging.info(f'ingested. {pid=}')
+    return self.posted(item, PARENT, pid)
+
+  def stage_child(self, child):
+    file = child.get('filepath')
+    if not file or Path(file).suffix.lower() not in self.allowed_streams:
+      # nothing to stage, ingest_files reports the problem
+      return None
+    if self.journal and self.journal.posted_pid(child['filename'], CHILD):
+      # skipped by ingest_child, don't copy it
+      return None
+    if self.context.upload:
+      # uploaded straight from the source by ingest_files
+      return None
+    staged = StagedFile(file, self.budget, algorithms=self.context.fixity, limiter=self.context.bandwidth)
+    if self.journal:
+      self.journal.mark_staged(child['filename'])
+    return staged
+
+  def ingest_child(self, child, parent_pid, staged=None):
+    try:
+      pid = self.resumed_pid(child, CHILD)
+      if pid:
+        return pid
+      if not staged and not self.prefetch:
+        staged = self.stage_child(child)
+      logging.info(f'Ingesting {child["filename"]} with parent {parent_pid}')
+      pid = ingest_files(
+        self.mods_path(child['filename']),
+        child['filepath'],
+        self.allowed_streams,
+        (parent_pid, child['relationship']),
+        staged_path=staged.path if staged else None,
+        context=self.context,
+        digests=staged.digests if staged else None
+      )
+      return self.posted(child, CHILD, pid)
+    finally:
+      if staged:
+        staged.release()
+
+  def record(self, item, pid=None, error=None, parent_pid=None):
+    if self.journal and error:
+      role = PARENT if 'children' in item and not item.get('pid') else CHILD
+      self.journal.mark_failed(item['filename'], role, error)
+    result = {
+      'filename': item['filename'],
+      'pid': pid,
+      'parent_pid': parent_pid,
+      'error': error,
+    }
+    self.results.append(result)
+    return result
+
+  def run(self, data):
+    """Ingests every item in data, returns one result dict per item."""
+    logging.info(f"Ingesting data with {self.workers} worker(s), prefetching {self.prefetch}")
+    if self.journal:
+      self.journal.plan(data)
+    self.scheduler.expect(data)
+    items = iter(item for item in data if item)
+    scheduler = self.scheduler
+    # (child, parent_pid, staged) waiting for a POST slot
+    staged = deque()
+    posting = {}
+    staging = {}
+
+    with ThreadPoolExecutor(max_workers=self.workers) as pool, \
+        ThreadPoolExecutor(max_workers=self.prefetch or 1) as stage_pool:
+      def next_child():
+        child = scheduler.pop()
+        if child:
+          return child
+        if len(posting) >= self.workers or scheduler.pending() >= self.lookahead:
+          return None
+        item = next(items, None)
+        if item is None:
+          return None
+        if item.get('pid'):
+          scheduler.add(item, item['pid'])
+          return False
+        # parents are metadata only and go straight to the POST pool
+        future = pool.submit(self.ingest_parent, item)
+        posting[future] = (item, None)
+        return False
+
+      def fill():
+        # staged files hold staging budget, post them first
+        while staged and len(posting) < self.workers:
+          child, parent_pid, staged_file = staged.popleft()
+          future = pool.submit(self.ingest_child, child, parent_pid, staged_file)
+          posting[future] = (child, parent_pid)
+        # the scheduler picks among the waiting children before new items are read
+        while True:
+          if self.prefetch and len(staging) + len(staged) >= self.prefetch:
+            return
+          if not self.prefetch and len(posting) >= self.workers:
+            return
+          child = next_child()
+          if child is None:
+            return
+          if child is False:
+            continue
+          if self.prefetch:
+            staging[stage_pool.submit(self.stage_child, child[0])] = child
+          else:
+            posting[pool.submit(self.ingest_child, *child)] = child
+
+      fill()
+      while posting or staging:
+        done, _ = wait(list(posting) + list(staging), return_when=FIRST_COMPLETED)
+        for future in done:
+          if future in staging:
+            child, parent_pid = staging.pop(future)
+            try:
+              staged.append((child, parent_pid, future.result()))
+            except Exception as e:
+              logging.exception(f"staging of {child['filename']} failed: {e}")
+              self.record(child, error=str(e) or type(e).__name__, parent_pid=parent_pid)
+              scheduler.finished(child)
+            continue
+          item, parent_pid = posting.pop(future)
+          if parent_pid:
+            scheduler.finished(item)
+          self.collect(future, item, parent_pid)
+        fill()
+
+    self.log_summary()
+    return self.results
+
+  def collect(self, future, item, parent_pid):
+    try:
+      pid = future.result()
+    except Exception as e:
+      logging.exception(f"ingest of {item['filename']} failed: {e}")
+      self.record(item, error=str(e) or type(e).__name__, parent_pid=parent_pid)
+      pid = None
+    else:
+      if not pid:
+        logging.warning(f"ingest failed, no pid for ingest of {item['filename']}")
+        self.record(item, error='no pid returned', parent_pid=parent_pid)
+      else:
+        self.record(item, pid=pid, parent_pid=parent_pid)
+
+    # only parent items carry children to fan out
+    if parent_pid or 'children' not in item:
+      return
+    for child in item['children']:
+      if not child:
+        continue
+      if not pid:
+        self.record(child, error=f"parent {item['filename']} was not ingested")
+        self.scheduler.drop(child)
+        continue
+      self.scheduler.add(child, pid)
+
+  def log_summary(self):
+    failed = [result for result in self.results if result['error']]
+    logging.info(f"Ingest finished: {len(self.results) - len(failed)} succeeded, {len(failed)} failed")
+    for result in failed:
+      logging.warning(f"failed: {result['filename']} - {result['error']}")
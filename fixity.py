@@ -0,0 +1,100 @@
+import csv
+import hashlib
+import logging
+import mmap
+import os
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_MANIFEST_PATH = Path.home().joinpath('.cache', 'gcp_ingest', 'fixity.tsv')
+
+ALGORITHMS = ('md5', 'sha256')
+# names the repository expects in content_streams
+CHECKSUM_TYPES = {'md5': 'MD5', 'sha256': 'SHA-256'}
+# a multiple of the page size; mmap hands out page-aligned memory
+HASH_BUFFER = 16 * 1024**2
+
+MANIFEST_FIELDS = ['filename', 'source', 'size', *ALGORITHMS, 'pid', 'time']
+
+def content_stream_checksum(digests:dict) -> dict:
+  """Returns the checksum fields of a content stream for the first digest."""
+  if not digests:
+    return {}
+  algorithm, digest = next(iter(digests.items()))
+  return {'checksum': digest, 'checksum_type': CHECKSUM_TYPES[algorithm]}
+
+def new_hashers(algorithms):
+  unknown = set(algorithms) - set(ALGORITHMS)
+  if unknown:
+    raise ValueError(f"unsupported fixity algorithm(s): {', '.join(sorted(unknown))}")
+  return {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+def digest_stream(src, hashers:dict, dst=None, limiter=None):
+  """Reads src to the end through one page-aligned buffer, updating every
+  hasher and writing each chunk to dst when given. Each chunk read is
+  charged to the limiter (a bdr_client.RateLimiter in bytes) when given."""
+  # freed with its last view, closing it here could fail while an
+  # exception still references a slice
+  view = memoryview(mmap.mmap(-1, HASH_BUFFER))
+  while True:
+    count = src.readinto(view)
+    if not count:
+      break
+    if limiter:
+      limiter.wait(count)
+    chunk = view[:count]
+    for hasher in hashers.values():
+      hasher.update(chunk)
+    written = 0
+    while dst and written < count:
+      written += dst.write(chunk[written:])
+  return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+def hash_file(path, algorithms=ALGORITHMS, limiter=None) -> dict:
+  """Returns {algorithm: hex digest} of path, read once."""
+  hashers = new_hashers(algorithms)
+  with open(path, 'rb', buffering=0) as src:
+    return digest_stream(src, hashers, limiter=limiter)
+
+def hash_copy_file(srcpath, newpath, algorithms=ALGORITHMS, limiter=None) -> dict:
+  """Copies srcpath to newpath and digests it in the same pass."""
+  hashers = new_hashers(algorithms)
+  with open(srcpath, 'rb', buffering=0) as src, open(newpath, 'wb', buffering=0) as dst:
+    return digest_stream(src, hashers, dst, limiter)
+
+class FixityManifest:
+  """Tab separated record of the digests of every posted file.
+
+  Rows are appended and flushed as each POST returns, so the manifest
+  of an interrupted run lists everything that made it."""
+
+  def __init__(self, path):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self.lock = threading.Lock()
+    new_file = not self.path.exists() or self.path.stat().st_size == 0
+    self.file = open(self.path, 'a', newline='')
+    self.writer = csv.DictWriter(self.file, MANIFEST_FIELDS, delimiter='\t', extrasaction='ignore')
+    if new_file:
+      self.writer.writeheader()
+    logging.info(f"Writing fixity manifest {self.path}")
+
+  def record(self, source, digests:dict, pid:str=None, size:int=None):
+    source = Path(source)
+    row = {
+      'filename': source.name,
+      'source': str(source),
+      'size': size if size is not None else source.stat().st_size,
+      'pid': pid or '',
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    row.update(digests)
+    with self.lock:
+      self.writer.writerow(row)
+      self.file.flush()
+      os.fsync(self.file.fileno())
+
+  def close(self):
+    with self.lock:
+      self.file.close()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+from journal import CHILD
+
+def row_key(row) -> str:
+  return str(row['identifierFileName']).strip()
+
+def row_hash(row) -> str:
+  return hashlib.sha256(json.dumps(row, sort_keys=True, default=str).encode()).hexdigest()
+
+class SheetChanges:
+  """Rows of a sheet that are new, changed or removed since the row
+  snapshot of the last incremental run, keyed by identifierFileName.
+
+  Only the delta is resolved and ingested. The parent rows of changed
+  children come along so they can be grouped; the journal skips those
+  parents and reuses their pids."""
+
+  def __init__(self, sheet_key:str, rows, snapshot:dict):
+    self.sheet_key = sheet_key
+    self.hashes = {}
+    self.complete = set()
+    for row in rows:
+      key = row_key(row)
+      if not key:
+        continue
+      if row.get('ingestcomplete'):
+        self.complete.add(key)
+      digest = row_hash(row)
+      if key in self.hashes:
+        # repeated filename, the rows change together
+        digest = hashlib.sha256((self.hashes[key] + digest).encode()).hexdigest()
+      self.hashes[key] = digest
+    self.new = [key for key in self.hashes if key not in snapshot]
+    self.changed = [key for key, digest in self.hashes.items() if key in snapshot and snapshot[key] != digest]
+    self.removed = [key for key in snapshot if key not in self.hashes]
+    self.unchanged = len(self.hashes) - len(self.new) - len(self.changed)
+
+  def delta(self, sheet):
+    """Returns the label row and the rows to resolve, in sheet order, for make_ingestable."""
+    keys = set(self.new) | set(self.changed)
+    rows = [row for row in sheet[1:] if row_key(row) in keys]
+    parents = {
+      str(row['parent']).strip() for row in rows
+      if row.get('parent') and type(row['parent']) is str
+    }
+    parents -= keys
+    if parents:
+      rows = [row for row in sheet[1:] if row_key(row) in keys or row_key(row) in parents]
+    logging.info(f"Resolving {len(rows)} of {len(sheet) - 1} rows, {len(parents)} of them unchanged parents")
+    return sheet[:1] + rows
+
+  def settled(self, results):
+    """Returns the hashes of the delta rows that need no further run:
+    ingested without error, or marked ingestcomplete. Failed and
+    unresolved rows stay out of the snapshot so the next run retries them."""
+    failed = {str(result['filename']).strip() for result in results if result['error']}
+    ingested = {str(result['filename']).strip() for result in results if result['pid'] and not result['error']}
+    return {
+      key: self.hashes[key] for key in self.new + self.changed
+      if key not in failed and (key in ingested or key in self.complete)
+    }
+
+  def report(self):
+    return {
+      'sheet': self.sheet_key,
+      'rows': len(self.hashes),
+      'unchanged': self.unchanged,
+      'new': self.new,
+      'changed': self.changed,
+      'removed': self.removed,
+    }
+
+  def log_report(self, journal=None):
+    logging.info(
+      f"{self.sheet_key}: {len(self.new)} new, {len(self.changed)} changed, "
+      f"{len(self.removed)} removed, {self.unchanged} unchanged rows"
+    )
+    for key in self.changed:
+      pid = journal.posted_pid(key, CHILD) if journal else None
+      if pid:
+        logging.warning(f"row {key} changed after it was ingested as {pid}, the object is not updated")
+      else:
+        logging.info(f"changed: {key}")
+    for key in self.removed:
+      logging.info(f"removed: {key}, nothing is deleted from the repository")
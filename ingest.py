@@ -1,10 +1,13 @@
 import logging
 from pathlib import Path
 import os
-import shutil
 from dotenv import load_dotenv, find_dotenv
-import requests
+from bdr_client import get_client
 import json
+from staging import stage_file, unstage
+from metrics import metrics
+from fixity import content_stream_checksum
+from upload import MultipartStream
 
 def setup_environment():
   """Updates sys.path and reads the .env settings.
@@ -51,37 +54,66 @@ def set_basic_params(env_vars):
   }
   return params
 
+class IngestContext:
+  """Per-run ingest settings, resolved once and shared by every call
+  to ingest_files."""
+
+  def __init__(self, env_vars:dict, client=None):
+    self.env_vars = env_vars
+    self.api_url = env_vars["api_url"]
+    self.base_params = set_basic_params(env_vars)
+    self.base_rels = json.loads(self.base_params["rels"])
+    self.client = client or get_client()
+    # ModsPreflight holding validated MODS text, if the run has one
+    self.mods = None
+    # fixity algorithms digested while staging, the first is sent to the API
+    self.fixity = ()
+    self.fixity_manifest = None
+    # stream files to the API in the POST body instead of staging them
+    self.upload = False
+    # bdr_client.RateLimiter in bytes per second, charged for every read from the shares
+    self.bandwidth = None
+
+  @classmethod
+  def from_environment(cls, client=None):
+    return cls(setup_environment(), client)
+
+  def params(self, parent_relationship=None):
+    """Returns a fresh copy of the basic params, with the parent
+    relationship added to rels when given."""
+    params = dict(self.base_params)
+    if parent_relationship:
+      (parent_pid, rel_type) = parent_relationship
+      rels = dict(self.base_rels)
+      rels[rel_type] = parent_pid
+      params["rels"] = json.dumps(rels)
+    return params
+
 class TempStagingPath:
-  def __init__(self,path):
+  def __init__(self,path,algorithms=(),limiter=None):
     path = Path(path)
     self.srcpath = path
+    self.algorithms = algorithms
+    self.limiter = limiter
+    self.digests = {}
 
   def __enter__(self,*args,**kwargs):
     logging.debug(f'{args=}')
     logging.debug(f'{kwargs=}')
-    if not self.srcpath.exists():
-      logging.error(f"path {self.srcpath} doesn't exist")
-      raise FileNotFoundError
-
-    staging_dir = Path(os.environ['STAGING_DIR'])
-    newpath = staging_dir.joinpath(self.srcpath.name)
-
-    shutil.copyfile(self.srcpath,newpath)
-    self.path = newpath
+    self.path, self.digests = stage_file(self.srcpath, algorithms=self.algorithms, limiter=self.limiter)
     return self.path
 
   def __exit__(self,*args,**kwargs):
     logging.debug(f'{args=}')
     logging.debug(f'{kwargs=}')
-    self.path.unlink()
+    unstage(self.path)
 
-def perform_post(api_url, data, files=None):
+def perform_post(api_url, data, files=None, client=None, headers=None):
   logging.info("performing post")
+  client = client or get_client()
   try:
-    if files:
-      r = requests.post(api_url, data=data, files=files)
-    else:
-      r = requests.post(api_url, data=data)
+    with metrics.stage('post'):
+      r = client.post(api_url, data=data, files=files, headers=headers)
   except Exception as e:
     logging.exception(f"error creating object: {e}")
     raise
@@ -97,7 +129,10 @@ def ingest_files(
     mods_path,
     file_path,
     allowed_streams:dict,
-    parent_relationship=None
+    parent_relationship=None,
+    staged_path=None,
+    context:IngestContext=None,
+    digests:dict=None
   ) -> str:
   """
   Ingests files into a system.
@@ -106,65 +141,98 @@ def ingest_files(
     file_path (str): The path to the file to ingest.
     allowed_streams (dict): A dictionary mapping file extensions to content streams.
     parent_relationship (tuple): The pid and relationship to parent. Defaults to None.
+    staged_path (str): Path of a copy already in the staging dir, owned by the caller. Defaults to None.
+    context (IngestContext): Settings shared across a run. Defaults to reading the environment.
+    digests (dict): Fixity of staged_path computed while staging it. Defaults to None.
   Returns:
     (str): The PID of the ingested files.
   """
 
-  env_vars = setup_environment()
-  params = set_basic_params(env_vars)
+  if context is None:
+    context = IngestContext.from_environment()
 
   mods_path = Path(mods_path)
-  if not mods_path.exists():
-    logging.WARNING(f"mods file {mods_path.name} does not exist. skipping...")
-    return
-  with open(mods_path, "r") as mods_file:
-    mods_file_obj = mods_file.read()
-
+  with metrics.stage('mods_read') as timer:
+    mods_file_obj = context.mods.text(mods_path) if context.mods else None
+    if mods_file_obj is None:
+      if not mods_path.exists():
+        logging.warning(f"mods file {mods_path.name} does not exist. skipping...")
+        return
+      with open(mods_path, "r") as mods_file:
+        mods_file_obj = mods_file.read()
+    timer.bytes = len(mods_file_obj)
+
+  if parent_relationship:
+    (parent_pid, rel_type) = parent_relationship
+    if rel_type not in ['isPartOf', 'isTranslationOf', 'isTranscriptOf']:
+      raise ValueError(f"Invalid relationship type: {rel_type}")
+  # Set the parent pid in rels
+  params = context.params(parent_relationship)
   params["mods"] = json.dumps({"xml_data": mods_file_obj})
 
   if not parent_relationship:
-    pid = perform_post(api_url=env_vars["api_url"], data=params)
+    pid = perform_post(api_url=context.api_url, data=params, client=context.client)
     return pid
 
-  (parent_pid, rel_type) = parent_relationship
-  if rel_type not in ['isPartOf', 'isTranslationOf', 'isTranscriptOf']:
-    raise ValueError(f"Invalid relationship type: {rel_type}")
-  # Read params['rels'] into a dict
-  temp_rels = json.loads(params["rels"])
-
-  # Set the parent pid and page number
-  temp_rels[rel_type] = parent_pid
-
-  # Convert params['rels'] back to a string
-  params["rels"] = json.dumps(temp_rels)
-
   if not file_path:
     logging.warning(f"While ingesting, there's no file path for {mods_path.name}")
     raise TypeError
   logging.debug(f"ingesting {file_path}")
 
   file = Path(file_path)
-  content_streams = []
 
   if allowed_streams and file.suffix.lower() not in allowed_streams.keys():
     logging.warning(f"File extension {file.suffix} not allowed. skipping...")
     return
   # params["content_model"] = allowed_streams[file.suffix]
 
-  with TempStagingPath(file) as newpath:
-    content_streams.append({
-      "dsID": allowed_streams[file.suffix.lower()],
-      "file_name": file.name,
-      "path":str(newpath)
-    })
-    params['content_streams'] = json.dumps(content_streams)
-
+  if context.upload:
+    return upload_file(context, params, file, allowed_streams)
+  if staged_path:
+    return post_file(context, params, file, staged_path, allowed_streams, digests)
+  staging = TempStagingPath(file, context.fixity, context.bandwidth)
+  with staging as newpath:
+    return post_file(context, params, file, newpath, allowed_streams, staging.digests)
+
+def post_file(context:IngestContext, params, file, staged_path, allowed_streams:dict, digests:dict=None):
+  content_streams = [{
+    "dsID": allowed_streams[file.suffix.lower()],
+    "file_name": file.name,
+    "path":str(staged_path),
+    **content_stream_checksum(digests),
+  }]
+  params['content_streams'] = json.dumps(content_streams)
+
+  if logging.getLogger().isEnabledFor(logging.DEBUG):
     logging.debug(f"{params=}")
     logging.debug(f"{content_streams=}")
 
-    pid = perform_post(api_url=env_vars["api_url"], data=params)
-
-    return pid
+  pid = perform_post(api_url=context.api_url, data=params, client=context.client)
+  if context.fixity_manifest and digests:
+    context.fixity_manifest.record(file, digests, pid)
+
+  return pid
+
+def upload_file(context:IngestContext, params, file, allowed_streams:dict):
+  """Posts the object with the file itself streamed as a multipart
+  upload, nothing is written to the staging dir."""
+  content_streams = [{
+    "dsID": allowed_streams[file.suffix.lower()],
+    "file_name": file.name,
+  }]
+  params['content_streams'] = json.dumps(content_streams)
+
+  body = MultipartStream(params, file.name, file, context.fixity, context.bandwidth)
+  pid = perform_post(
+    api_url=context.api_url,
+    data=body,
+    client=context.client,
+    headers={'Content-Type': body.content_type}
+  )
+  if context.fixity_manifest and body.digests:
+    context.fixity_manifest.record(file, body.digests, pid, body.size)
+
+  return pid
 
 if __name__ == "__main__":
   logging.info("__name__ is `main`")
@@ -0,0 +1,149 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_JOURNAL_PATH = Path.home().joinpath('.cache', 'gcp_ingest', 'journal.sqlite')
+
+PLANNED = 'planned'
+STAGED = 'staged'
+POSTED = 'posted'
+FAILED = 'failed'
+
+# a parent object and the child holding its file share one filename
+PARENT = 'parent'
+CHILD = 'child'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+  collection TEXT NOT NULL,
+  filename TEXT NOT NULL,
+  role TEXT NOT NULL,
+  parent TEXT,
+  state TEXT NOT NULL,
+  pid TEXT,
+  error TEXT,
+  updated TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (collection, filename, role)
+)
+"""
+
+# content hash of every sheet row ingested by an incremental run
+ROWS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS row_hashes (
+  collection TEXT NOT NULL,
+  sheet TEXT NOT NULL,
+  filename TEXT NOT NULL,
+  hash TEXT NOT NULL,
+  updated TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (collection, sheet, filename)
+)
+"""
+
+class IngestJournal:
+  """Crash-safe record of each filename's ingest state for a collection.
+
+  Every state change is committed before the run moves on, so a re-run
+  of the same sheet can skip items already posted and reuse the pids of
+  parents created by an earlier run."""
+
+  def __init__(self, path=DEFAULT_JOURNAL_PATH, collection:str=''):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self.collection = collection
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(self.path, check_same_thread=False)
+    self.conn.execute('PRAGMA journal_mode=WAL')
+    self.conn.execute('PRAGMA synchronous=FULL')
+    with self.conn:
+      self.conn.execute(SCHEMA)
+      self.conn.execute(ROWS_SCHEMA)
+    logging.info(f"Using ingest journal {self.path} for {collection}")
+
+  @staticmethod
+  def key(filename):
+    return str(filename).strip()
+
+  def plan(self, data):
+    """Records every item of the parented data as planned.
+    Items already in the journal keep their state."""
+    rows = []
+    for item in data:
+      if not item:
+        continue
+      if item.get('pid'):
+        # pid-resumed rows name their parent by pid
+        rows.append((self.collection, self.key(item['filename']), CHILD, item['pid'], PLANNED))
+        continue
+      rows.append((self.collection, self.key(item['filename']), PARENT, None, PLANNED))
+      for child in item.get('children', []):
+        if child:
+          rows.append((self.collection, self.key(child['filename']), CHILD, self.key(item['filename']), PLANNED))
+    with self.lock, self.conn:
+      self.conn.executemany(
+        'INSERT OR IGNORE INTO items (collection, filename, role, parent, state) VALUES (?, ?, ?, ?, ?)',
+        rows
+      )
+
+  def set_state(self, filename, role:str, state:str, pid:str=None, error:str=None):
+    with self.lock, self.conn:
+      self.conn.execute(
+        'INSERT INTO items (collection, filename, role, state, pid, error) VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT (collection, filename, role) DO UPDATE SET '
+        'state = excluded.state, pid = COALESCE(excluded.pid, items.pid), '
+        'error = excluded.error, updated = CURRENT_TIMESTAMP',
+        (self.collection, self.key(filename), role, state, pid, error)
+      )
+
+  def mark_staged(self, filename, role:str=CHILD):
+    self.set_state(filename, role, STAGED)
+
+  def mark_posted(self, filename, role:str, pid:str):
+    self.set_state(filename, role, POSTED, pid=pid)
+
+  def mark_failed(self, filename, role:str, error:str):
+    self.set_state(filename, role, FAILED, error=error)
+
+  def posted_pid(self, filename, role:str):
+    """Returns the pid of filename if an earlier run posted it."""
+    with self.lock:
+      row = self.conn.execute(
+        'SELECT pid FROM items WHERE collection = ? AND filename = ? AND role = ? AND state = ?',
+        (self.collection, self.key(filename), role, POSTED)
+      ).fetchone()
+    return row[0] if row else None
+
+  def row_hashes(self, sheet:str):
+    """Returns {filename: hash} of the sheet rows snapshotted by earlier runs."""
+    with self.lock:
+      rows = self.conn.execute(
+        'SELECT filename, hash FROM row_hashes WHERE collection = ? AND sheet = ?',
+        (self.collection, sheet)
+      ).fetchall()
+    return dict(rows)
+
+  def save_row_hashes(self, sheet:str, hashes:dict, removed=()):
+    """Stores the hashes of the given rows and forgets the removed ones."""
+    with self.lock, self.conn:
+      self.conn.executemany(
+        'INSERT INTO row_hashes (collection, sheet, filename, hash) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT (collection, sheet, filename) DO UPDATE SET '
+        'hash = excluded.hash, updated = CURRENT_TIMESTAMP',
+        [(self.collection, sheet, self.key(filename), row_hash) for filename, row_hash in hashes.items()]
+      )
+      self.conn.executemany(
+        'DELETE FROM row_hashes WHERE collection = ? AND sheet = ? AND filename = ?',
+        [(self.collection, sheet, self.key(filename)) for filename in removed]
+      )
+
+  def counts(self):
+    """Returns the number of items per state."""
+    with self.lock:
+      rows = self.conn.execute(
+        'SELECT state, COUNT(*) FROM items WHERE collection = ? GROUP BY state',
+        (self.collection,)
+      ).fetchall()
+    return dict(rows)
+
+  def close(self):
+    self.conn.close()
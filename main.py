@@ -1,9 +1,24 @@
 import os
-from pathlib import Path, PureWindowsPath
+import json
+from pathlib import Path
 from argparse import ArgumentParser
 from pprint import pformat
 from dotenv import load_dotenv
-from ingest import ingest_files
+from executor import IngestExecutor
+from dirindex import DirIndex, DEFAULT_CACHE_PATH
+from pathmap import PathTranslator, parse_mount, split_windows_path
+from staging import parse_size
+from scheduler import ChildScheduler, parse_mount_limit
+from bdr_client import get_client, RateLimiter
+from ingest import IngestContext
+from mods import ModsPreflight, drop_bad_items
+from journal import IngestJournal, DEFAULT_JOURNAL_PATH
+from metrics import metrics
+from plan import write_plan, read_plan
+from incremental import SheetChanges
+from reconcile import RepositoryIndex, Reconciliation
+from fixity import FixityManifest, ALGORITHMS as FIXITY_ALGORITHMS, DEFAULT_MANIFEST_PATH as DEFAULT_FIXITY_MANIFEST
+from sheet_reader import get_sheet_names, load_sheet, DEFAULT_CACHE_DIR as DEFAULT_SHEET_CACHE
 import logging
 import pandas as pd
 
@@ -12,7 +27,8 @@ stream_map = {
   ".mp4": "VIDEO-MASTER",
   ".pdf": "PDF",
 }
-cache = {}
+path_translator = PathTranslator()
+dir_index = DirIndex()
 
 def abbr_path(path:str, length:int, sep:str='/',abbr_len:int=2):
   if len(path) < length:
@@ -32,59 +48,37 @@ def abbr_path(path:str, length:int, sep:str='/',abbr_len:int=2):
     return test_path
   return '...'+test_path[length-3:]
 
-def get_cache_options(split_path:list):
-  # logging.debug(f"Getting cache options from split path {split_path}")
-  cache_options = []
-  for i in range(len(split_path), 0, -1):
-    cache_options.append('\\'.join(split_path[:i+1]))
-  return cache_options
-
-def get_mnt_path_from_windows_path(windows_path:str, cache={'mntdir':{'path':Path('/mnt')}}):
+def get_mnt_path_from_windows_path(windows_path:str):
   sep='\\'
-  logging.debug(f"Getting mnt path from windows path {abbr_path(windows_path,40,sep)}")
-  if windows_path in cache:
-    return cache[windows_path]['path']
-
-  winpath = PureWindowsPath(windows_path)
-  new_root = cache['mntdir']['path'].joinpath(winpath.drive[0].lower())
-
-  split_path = windows_path.split('\\')
-  cache_options = get_cache_options(split_path)
-  # logging.debug(f"Cache options: {cache_options}")
-
-  for option in cache_options:
-    if option in cache:
-      # get the remaining path after the cached path
-      remaining_path = '\\'.join(split_path[len(option.split('\\')):])
-      return cache[option]['path'].joinpath(remaining_path)
-    else:
-      filepath = new_root.joinpath(*option.split('\\')[1:])
-      cache[option] = {'path':filepath}
-
-  cache[windows_path] = {'path': filepath}
-
-  return filepath
+  if logging.getLogger().isEnabledFor(logging.DEBUG):
+    logging.debug(f"Getting mnt path from windows path {abbr_path(windows_path,40,sep)}")
+  with metrics.stage('path_translation'):
+    return path_translator.translate(windows_path)
 
 def dict_from_row(row, pid=None):
   logging.debug(f"Creating dict from row {row.get('identifierFileName')}")
   # Get the filepath from the row and replace the drive letter
   filepath_str = row['filepath']
-  filepath = get_mnt_path_from_windows_path(filepath_str,cache)
-  # add path to cache
-  cache[filepath_str]['path'] = filepath
   filename = str(row['identifierFileName']).strip()
-  if not filepath.exists():
+  try:
+    filepath = get_mnt_path_from_windows_path(filepath_str)
+  except ValueError as e:
+    # UNC or driveless path without a --mount for it
+    logging.warning(f"Row {filename}: cannot translate path {filepath_str}: {e}")
+    return {}
+  try:
+    with metrics.stage('dir_lookup'):
+      files = dir_index.find(filepath, filename, allowed_streams=stream_map.keys())
+  except FileNotFoundError:
     logging.warning(f"File {filepath} does not exist")
     return {}
-  if not filepath.is_dir():
+  except NotADirectoryError:
     logging.warning(f"File {filepath} is not a directory")
     return {}
-
-  if not cache[filepath_str].get('glob', None):
-    cache[filepath_str]['glob'] = list(filepath.glob('*'))
-  fileglob = cache[filepath_str]['glob']
-  logging.debug(f"Fileglob: {fileglob}")
-  files = file_from_glob(filename, fileglob,allowed_streams=stream_map.keys())
+  except OSError as e:
+    # e.g. a restricted directory on the share, the rest of the sheet carries on
+    logging.warning(f"Row {filename}: cannot list {filepath}: {e}")
+    return {}
 
   if len(files) == 0:
     logging.warning(f"No files found for {filename} in {filepath}")
@@ -96,6 +90,8 @@ def dict_from_row(row, pid=None):
   result_dict = {
     'filepath': files[0],
     'filename': filename,
+    # the share the file is read from, for the per-mount read caps
+    'drive': split_windows_path(filepath_str)[0].rstrip(':').upper(),
   }
 
   # return early if there is no parent
@@ -121,25 +117,15 @@ def dict_from_row(row, pid=None):
     })
   return result_dict
 
-def file_from_glob(filename, fileglob,allowed_streams=[]):
-  files = []
-  for file in fileglob:
-    if filename == file.name:
-      return [file]
-    if file.stem != filename:
-      logging.debug(f"Skipping file {file.name} because {file.stem} != {filename}")
-      continue
-    if allowed_streams and file.suffix.lower() not in allowed_streams:
-      logging.debug(f"Skipping {file.suffix[1:].upper()} file {file.name}")
-      continue
-    logging.debug(f"Found {file.suffix[1:].upper()} file {file.name}")
-    files.append(file)
-  return files
-
-def make_ingestable(data: pd.DataFrame):
+def make_ingestable(data):
+  """Groups sheet rows (a list of row dicts or a DataFrame) into parents
+  with their children."""
   logging.info("Making data ingestable")
 
-  data_dict = data.to_dict('records')
+  if isinstance(data, pd.DataFrame):
+    data_dict = data.to_dict('records')
+  else:
+    data_dict = list(data)
   data_dict.pop(0)
   logging.debug([
       { "parent":row['parent'],
@@ -147,6 +133,13 @@ def make_ingestable(data: pd.DataFrame):
       } for row in data_dict[:4]
   ])
 
+  # index children by the identifierFileName of their parent, in sheet order
+  children_by_parent = {}
+  for child in data_dict:
+    if not child['identifierFileName']:
+      continue
+    children_by_parent.setdefault(child['parent'], []).append(child)
+
   parented_data = []
   for row in data_dict:
     if row.get('ingestcomplete') and not row.get('pid'):
@@ -158,144 +151,422 @@ def make_ingestable(data: pd.DataFrame):
     if row['parent'] and type(row['parent']) is str:
       continue
 
+    children = children_by_parent.get(row['identifierFileName'], [])
     if row.get("pid"):
-      for child in data_dict:
+      for child in children:
         if child.get('ingestcomplete'):
           logging.debug(f"ingest already completed for {child['itemTitle']}")
           continue
-        if not child['identifierFileName']:
-          continue
-        if child['parent'] == row['identifierFileName']:
-          parented_data.append(dict_from_row(child,row['pid']))
+        parented_data.append(dict_from_row(child,row['pid']))
       continue
     parent = {
       "filename": row['identifierFileName'],
       "filepath": None,
       'children': [dict_from_row(row)],
     }
-    for child in data_dict:
-      if not child['identifierFileName']:
-        continue
-      if child['parent'] == row['identifierFileName']:
-        parent['children'].append(dict_from_row(child))
+    for child in children:
+      parent['children'].append(dict_from_row(child))
     parented_data.append(parent)
 
-  logging.debug(pformat(parented_data,sort_dicts=False,))
+  if logging.getLogger().isEnabledFor(logging.DEBUG):
+    logging.debug(pformat(parented_data,sort_dicts=False,))
   return parented_data
 
-def ingest_data(data, mods_dir):
+def ingest_data(data, mods_dir, workers=1, prefetch=0, staging_budget=None, journal=None, mods=None, fixity=(), fixity_manifest=None, upload=False, scheduler=None, bandwidth=None):
   logging.info("Ingesting data")
-  for item in data:
-    if not item:
-      continue
-    filepath = item['filepath']
-    filename = item['filename'].strip()
-    parent_pid = item.get('pid',None)
-
-    mods = Path(mods_dir).joinpath(f'{filename}.mods.xml')
-
-    if parent_pid:
-      logging.info(f'Ingesting {item["filename"]} with parent {parent_pid}')
-      ingest_files(mods, filepath,stream_map,(parent_pid,item['relationship']))
-      continue
-
-    logging.info(f'Ingesting parent item {item["filename"]}')
-    pid = ingest_files(mods, filepath, stream_map)
-    if not pid:
-      logging.warning(f"ingest failed, no pid for ingest of {filename}")
-    # pid = '12345'
-    logging.info(f'ingested. {pid=}')
-
-    for child in item['children']:
-      if not child:
-        continue
-      mods = Path(mods_dir).joinpath(f'{child["filename"]}.mods.xml')
-      logging.info(f'Ingesting {child["filename"]} with parent {pid}')
-      ingest_files(mods, child['filepath'], stream_map, (pid,child['relationship']))
+  # resolve config and base params once for the whole run
+  context = IngestContext.from_environment(get_client())
+  context.mods = mods
+  context.fixity = tuple(fixity or ())
+  context.fixity_manifest = fixity_manifest
+  context.upload = upload
+  # charged one unit per byte read from the shares
+  context.bandwidth = RateLimiter(bandwidth) if bandwidth else None
+  executor = IngestExecutor(
+    mods_dir,
+    stream_map,
+    workers=workers,
+    prefetch=prefetch,
+    staging_budget=staging_budget,
+    journal=journal,
+    context=context,
+    scheduler=scheduler
+  )
+  return executor.run(data)
 
-def check_ingestable_for_mods(data, mods_dir):
-  logging.info("Ingesting data")
+def check_ingestable_for_mods(data, mods_dir, processes=None):
+  logging.info("Checking MODS")
   for item in data:
-    if not item:
-      continue
-    filename = item['filename'].strip()
-
-    mods = Path(mods_dir).joinpath(f'{filename}.mods.xml')
-    if not mods.exists():
-        logging.warning(f"mods {mods.name} does not exist")
-
-    if "children" not in item.keys():
+    if item and "children" not in item.keys():
       logging.warning(f"item has no key 'children': {item}")
-
-    for child in item['children']:
-      if not child:
-        continue
-      mods = Path(mods_dir).joinpath(f'{child["filename"]}.mods.xml')
-      if not mods.exists():
-        logging.warning(f"mods {mods.name} does not exist")
+  preflight = ModsPreflight(mods_dir).run(data, processes)
+  preflight.log_problems()
+  return preflight
 
 def get_sheet_name(filepath):
-  sheets = pd.ExcelFile(filepath).sheet_names
+  sheets = get_sheet_names(filepath)
   for i, sheet in enumerate(sheets):
     print(i,sheet)
   sheet_num = int(input("Enter the number of the sheet you want to ingest: "))
   return sheets[sheet_num]
 
-def check_cols(filepath,sheet_name=None):
-  with open(filepath, 'rb') as f:
-    # print names of sheets
-    if not sheet_name:
-      sheet_name = get_sheet_name(filepath)
-    data = pd.read_excel(f,sheet_name)
-    # Remove empty rows
-    data.dropna(how='all', inplace=True)
-    data.fillna('',inplace=True)
-    # Check for empty column headers in pandas dataframe
-    headers = data.columns
-    # logging.debug(f"Headers: {headers}")
-    second_row = data.iloc[0]
-    for i, header in enumerate(headers):
-      if 'Unnamed' in header:
-        if "parent" in second_row[i].lower():
-          data.rename(columns={header: 'parent'}, inplace=True)
-          continue
-        if "filepath" in second_row[i].lower():
-          data.rename(columns={header: 'filepath'}, inplace=True)
-          continue
-        print(f"Column {i + 1} is missing, second row value is {second_row[i]}")
-        new_header = input(f"Enter the column header for column {i + 1}: ")
-        if not new_header.isidentifier():
-          raise ValueError(f"'{new_header}' is not a valid column header")
-        data.rename(columns={header: new_header}, inplace=True)
-    return data
+def check_cols(filepath,sheet_name=None,cache_dir=DEFAULT_SHEET_CACHE,column_map=None):
+  """Reads the sheet as a list of row dicts, with empty rows removed and
+  unnamed column headers resolved.
+  With a column_map ({header: new_header}) nothing is asked on the
+  console: mapped headers are renamed and an unnamed column that can't
+  be resolved raises ValueError."""
+  # print names of sheets
+  if not sheet_name:
+    sheet_name = get_sheet_name(filepath)
+  with metrics.stage('sheet_load', os.path.getsize(filepath)):
+    headers, data = load_sheet(filepath, sheet_name, cache_dir)
+  # Check for empty column headers
+  # logging.debug(f"Headers: {headers}")
+  second_row = data[0]
+  renames = {}
+  for i, header in enumerate(headers):
+    if column_map and header in column_map:
+      renames[header] = column_map[header]
+      continue
+    if 'Unnamed' in str(header):
+      second_value = str(second_row[header])
+      if "parent" in second_value.lower():
+        renames[header] = 'parent'
+        continue
+      if "filepath" in second_value.lower():
+        renames[header] = 'filepath'
+        continue
+      if column_map is not None:
+        raise ValueError(f"Column {i + 1} has no header and no mapping, second row value is {second_value}")
+      print(f"Column {i + 1} is missing, second row value is {second_value}")
+      new_header = input(f"Enter the column header for column {i + 1}: ")
+      if not new_header.isidentifier():
+        raise ValueError(f"'{new_header}' is not a valid column header")
+      renames[header] = new_header
+  if renames:
+    data = [{renames.get(key, key): value for key, value in row.items()} for row in data]
+  return data
+
+def set_mount_dir(mntdir, mounts=None):
+  global path_translator
+  path_translator = PathTranslator(mntdir, dict(mounts or {}))
+
+def resolve_rows(sheet, dirindex=DEFAULT_CACHE_PATH):
+  """Resolves sheet rows into parented data through the directory index."""
+  dir_index.cache_path = Path(dirindex) if dirindex else None
+  dir_index.load()
+  try:
+    return make_ingestable(sheet)
+  finally:
+    dir_index.save()
+
+def plan_sheet(data_file, sheet_name=None, sheet_cache=DEFAULT_SHEET_CACHE, dirindex=DEFAULT_CACHE_PATH, column_map=None):
+  """Reads a sheet and resolves it into parented data."""
+  sheet = check_cols(data_file, sheet_name, sheet_cache, column_map)
+  return resolve_rows(sheet, dirindex)
+
+def plan_incremental(data_file, journal, sheet_name=None, sheet_cache=DEFAULT_SHEET_CACHE, dirindex=DEFAULT_CACHE_PATH, column_map=None):
+  """Reads a sheet and resolves only the rows that are new or changed
+  since the row snapshot in the journal, returns (parented data, changes)."""
+  if not sheet_name:
+    sheet_name = get_sheet_name(data_file)
+  sheet = check_cols(data_file, sheet_name, sheet_cache, column_map)
+  sheet_key = f'{Path(data_file).name}:{sheet_name}'
+  changes = SheetChanges(sheet_key, sheet[1:], journal.row_hashes(sheet_key))
+  changes.log_report(journal)
+  return resolve_rows(changes.delta(sheet), dirindex), changes
+
+def run_ingest(
+    data,
+    mods_dir,
+    workers=1,
+    prefetch=0,
+    staging_budget=None,
+    journal_path=DEFAULT_JOURNAL_PATH,
+    skip_bad_mods=False,
+    mods_processes=None,
+    fixity=(),
+    fixity_manifest_path=DEFAULT_FIXITY_MANIFEST,
+    upload=False,
+    reconcile=False,
+    mount_readers=None,
+    mount_limits=None,
+    bandwidth=None,
+    large_file=None
+  ):
+  """Ingests parented data, with a journal unless journal_path is None.
+  Every MODS file is validated first; a missing or malformed one stops
+  the run before any upload, unless skip_bad_mods drops those items.
+  With fixity algorithms every file is digested while it is staged (or
+  uploaded) and the digests are appended to the fixity manifest. With
+  upload the files are streamed in the POST body instead of staged.
+  With reconcile, items already in the collection (by Solr) are skipped
+  and returned as results without being posted. Children are started
+  by mount, mount_readers (or mount_limits per drive) files read at once
+  from a mount, and with large_file by size. Every chunk read from the
+  shares counts against bandwidth bytes per second."""
+  existing = []
+  if reconcile:
+    data, existing = reconcile_with_repository(data)
+  preflight = check_ingestable_for_mods(data, mods_dir, mods_processes)
+  if not preflight.ok:
+    if not skip_bad_mods:
+      raise ValueError(
+        f"{len(preflight.missing)} missing and {len(preflight.invalid)} invalid MODS files, not ingesting"
+      )
+    data = drop_bad_items(data, preflight.bad_names())
+
+  journal = None
+  if journal_path:
+    journal = IngestJournal(journal_path, os.environ['COLLECTION_PID'])
+    for result in existing:
+      journal.mark_posted(result['filename'], result['role'], result['pid'])
+  fixity_manifest = None
+  if fixity and fixity_manifest_path:
+    fixity_manifest = FixityManifest(fixity_manifest_path)
+  try:
+    results = ingest_data(
+      data,
+      mods_dir,
+      workers=workers,
+      prefetch=prefetch,
+      staging_budget=staging_budget,
+      journal=journal,
+      mods=preflight,
+      fixity=fixity,
+      fixity_manifest=fixity_manifest,
+      upload=upload,
+      scheduler=ChildScheduler(mount_readers, mount_limits, large_file, max(1, workers // 2)),
+      bandwidth=bandwidth
+    )
+  finally:
+    if journal:
+      logging.info(f"Journal states: {journal.counts()}")
+      journal.close()
+    if fixity_manifest:
+      fixity_manifest.close()
+  get_client().log_stats()
+  return existing + results
+
+def reconcile_with_repository(data):
+  """Drops the items of data that already exist in COLLECTION_PID,
+  looked up in one paged bulk Solr query. Returns (kept data, results
+  of the existing items)."""
+  index = RepositoryIndex(os.environ['SOLR_URL'], os.environ['COLLECTION_PID']).load(get_client())
+  reconciliation = Reconciliation(index)
+  return reconciliation.run(data), reconciliation.existing
+
+def write_metrics(json_path=None, textfile_path=None, labels=None):
+  """Writes the stage metrics of this run, for humans and for the
+  node exporter textfile collector."""
+  if json_path:
+    metrics.write_json(json_path, {'labels': labels or {}})
+    logging.info(f"Wrote metrics to {json_path}")
+  if textfile_path:
+    metrics.write_prometheus(textfile_path, labels)
+    logging.info(f"Wrote Prometheus metrics to {textfile_path}")
+
+def load_plan(plan_path):
+  """Reads a plan written by --write-plan, returns (parented data, mods dir)."""
+  header, data = read_plan(plan_path)
+  if header['collection'] != os.environ['COLLECTION_PID']:
+    raise ValueError(
+      f"plan {plan_path} was made for collection {header['collection']}, not {os.environ['COLLECTION_PID']}"
+    )
+  return data, header['mods_dir']
 
 def main(args):
   load_dotenv()
-  mods_dir = os.environ['MODS_DIR']
-  sheet = check_cols(args.data_file, args.sheet)
-  data = make_ingestable(sheet)
-  if args.mock:
-    check_ingestable_for_mods(data, mods_dir)
-    logging.debug(pformat(data,sort_dicts=False))
-    logging.info("Mock run, not ingesting")
-    return
-  ingest_data(data, mods_dir)
+  source = args.execute_plan or args.data_file
+  snapshot = changes = None
+  try:
+    if args.execute_plan:
+      # the plan is already resolved, skip the sheet and the shares
+      data, mods_dir = load_plan(args.execute_plan)
+    elif args.incremental:
+      if args.no_journal:
+        raise ValueError("--incremental keeps its row snapshot in the journal, it can't run with --no-journal")
+      mods_dir = os.environ['MODS_DIR']
+      snapshot = IngestJournal(args.journal, os.environ['COLLECTION_PID'])
+      data, changes = plan_incremental(args.data_file, snapshot, args.sheet, args.sheet_cache, args.dirindex)
+      if args.change_report:
+        with open(args.change_report, 'w') as f:
+          json.dump(changes.report(), f, indent=2)
+    else:
+      mods_dir = os.environ['MODS_DIR']
+      data = plan_sheet(args.data_file, args.sheet, args.sheet_cache, args.dirindex)
+    if args.write_plan:
+      write_plan(args.write_plan, data, mods_dir, os.environ['COLLECTION_PID'], args.data_file)
+    if args.mock:
+      if args.reconcile:
+        data, _ = reconcile_with_repository(data)
+      check_ingestable_for_mods(data, mods_dir, args.mods_processes)
+      if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(pformat(data,sort_dicts=False))
+      logging.info("Mock run, not ingesting")
+      return
+    results = run_ingest(
+      data,
+      mods_dir,
+      workers=args.workers,
+      prefetch=args.prefetch,
+      staging_budget=args.staging_budget,
+      journal_path=None if args.no_journal else args.journal,
+      skip_bad_mods=args.skip_bad_mods,
+      mods_processes=args.mods_processes,
+      fixity=args.fixity,
+      fixity_manifest_path=args.fixity_manifest,
+      upload=args.upload,
+      reconcile=args.reconcile,
+      mount_readers=args.mount_readers,
+      mount_limits=dict(args.mount_limits),
+      bandwidth=args.bandwidth,
+      large_file=args.large_file
+    )
+    if changes:
+      settled = changes.settled(results)
+      snapshot.save_row_hashes(changes.sheet_key, settled, changes.removed)
+      logging.info(
+        f"Row snapshot updated for {len(settled)} of {len(changes.new) + len(changes.changed)} new or changed rows, "
+        f"the rest are retried next run"
+      )
+  finally:
+    if snapshot:
+      snapshot.close()
+    write_metrics(args.metrics_json, args.metrics_textfile, {'workbook': Path(source).name})
 
 def parse_arguments():
   parser = ArgumentParser()
   parser.add_argument('data_file',
     type=Path,
+    nargs='?',
     help='Path to the data file'
   )
+  parser.add_argument('--write-plan',
+    type=Path,
+    help='Write the resolved ingest plan as JSON lines to this path, use with --mock to only plan'
+  )
+  parser.add_argument('--incremental',
+    action='store_true',
+    help='Only resolve and ingest rows that are new or changed since the last incremental run of the sheet'
+  )
+  parser.add_argument('--change-report',
+    type=Path,
+    help='With --incremental, write the new, changed and removed rows as JSON to this path'
+  )
+  parser.add_argument('--execute-plan',
+    type=Path,
+    help='Ingest a plan written by --write-plan instead of reading a data file'
+  )
   parser.add_argument('--mntdir',
     type=str,
     default='/mnt',
     help='Parent dir of mount(s), win drive letter is used as actual mountpoint'
   )
+  parser.add_argument('--mount',
+    dest='mounts',
+    type=parse_mount,
+    action='append',
+    default=[],
+    help=r'Map a windows path prefix to a mount root, e.g. "X:\share=/mnt/share". Repeatable'
+  )
+  parser.add_argument('--dirindex',
+    type=Path,
+    default=DEFAULT_CACHE_PATH,
+    help='Path of the persistent directory index for mounted shares'
+  )
   parser.add_argument('--sheet',
     type=str,
     help='Sheet name in the excel file'
   )
+  parser.add_argument('--workers',
+    type=int,
+    default=1,
+    help='Number of items to ingest concurrently, parents are created before their children'
+  )
+  parser.add_argument('--prefetch',
+    type=int,
+    default=0,
+    help='Number of files to stage ahead while POSTs are in flight, 0 stages each file just before its POST'
+  )
+  parser.add_argument('--staging-budget',
+    type=parse_size,
+    default=None,
+    help='Maximum bytes to hold in STAGING_DIR when prefetching, e.g. 200G'
+  )
+  parser.add_argument('--mount-readers',
+    type=int,
+    default=None,
+    help='Maximum files read at once from each mounted share, default unlimited'
+  )
+  parser.add_argument('--mount-limit',
+    dest='mount_limits',
+    type=parse_mount_limit,
+    action='append',
+    default=[],
+    help='Maximum files read at once from one drive, e.g. "X=2", overrides --mount-readers. Repeatable'
+  )
+  parser.add_argument('--bandwidth',
+    type=parse_size,
+    default=None,
+    help='Ceiling on bytes read per second across all mounts by staging copies, digests and uploads, e.g. 200M'
+  )
+  parser.add_argument('--large-file',
+    type=parse_size,
+    default=None,
+    help='Files of at least this size share at most half of the workers, e.g. 1G. Every file is stat\'ed up front for it'
+  )
+  parser.add_argument('--journal',
+    type=Path,
+    default=DEFAULT_JOURNAL_PATH,
+    help='SQLite journal of ingested items, used to resume an interrupted run'
+  )
+  parser.add_argument('--no-journal',
+    action='store_true',
+    help='Ingest every item without reading or writing the journal'
+  )
+  parser.add_argument('--sheet-cache',
+    type=Path,
+    default=DEFAULT_SHEET_CACHE,
+    help='Directory caching parsed sheets, keyed by workbook hash and sheet name'
+  )
+  parser.add_argument('--skip-bad-mods',
+    action='store_true',
+    help='Leave out items whose MODS is missing or malformed instead of stopping'
+  )
+  parser.add_argument('--mods-processes',
+    type=int,
+    default=None,
+    help='Processes used to validate MODS files, defaults to the CPU count'
+  )
+  parser.add_argument('--reconcile',
+    action='store_true',
+    help='Skip items already in the collection, found with bulk Solr queries on SOLR_URL, and reuse their parent pids'
+  )
+  parser.add_argument('--upload',
+    action='store_true',
+    help='Stream files from the mount to the API as multipart uploads instead of staging them'
+  )
+  parser.add_argument('--fixity',
+    choices=FIXITY_ALGORITHMS,
+    action='append',
+    default=[],
+    help='Digest every file while staging it and send the first digest as its checksum. Repeatable'
+  )
+  parser.add_argument('--fixity-manifest',
+    type=Path,
+    default=DEFAULT_FIXITY_MANIFEST,
+    help='Tab separated manifest the digests of posted files are appended to'
+  )
+  parser.add_argument('--metrics-json',
+    type=Path,
+    help='Write per-stage counts, bytes and latency histograms as JSON to this path'
+  )
+  parser.add_argument('--metrics-textfile',
+    type=Path,
+    help='Write the stage metrics in Prometheus text format, e.g. into the node exporter textfile dir'
+  )
   parser.add_argument('--mock',
     action='store_true',
     help='Run without ingesting'
@@ -306,6 +577,12 @@ def parse_arguments():
     default='INFO',
     help="Set the logging level")
   args = parser.parse_args()
+  if not args.data_file and not args.execute_plan:
+    parser.error('a data_file or --execute-plan is required')
+  if args.data_file and args.execute_plan:
+    parser.error('--execute-plan replaces the data_file, give only one')
+  if args.incremental and args.execute_plan:
+    parser.error('--incremental works on a data_file, not on a plan')
   return args
 
 if __name__ == '__main__':
@@ -319,10 +596,6 @@ if __name__ == '__main__':
         logging.StreamHandler()
     ]
   )
-  mount_dirpath = Path(args.mntdir)
-  cache.update({
-    'mntdir': {'path':mount_dirpath},
-    args.mntdir: {'path':mount_dirpath}
-  })
+  set_mount_dir(args.mntdir, args.mounts)
   main(args)
 
@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+# upper bounds in seconds, from path lookups up to large uploads
+DEFAULT_BUCKETS = (0.0001, 0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120, 600)
+
+class StageTimer:
+  """Times one pass through a stage; set .bytes inside the block when
+  the size is only known there."""
+
+  def __init__(self, metrics, name:str, nbytes:int=0):
+    self.metrics = metrics
+    self.name = name
+    self.bytes = nbytes
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.metrics.observe(self.name, time.perf_counter() - self.start, self.bytes, exc_type is not None)
+    return False
+
+class Metrics:
+  """Counts, bytes and a latency histogram per ingest stage.
+
+  Stages are recorded from every thread of the run; the totals are
+  written as JSON and as a Prometheus textfile for the node exporter."""
+
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.buckets = tuple(buckets)
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.stages = {}
+      self.started = time.time()
+
+  def stage(self, name:str, nbytes:int=0) -> StageTimer:
+    return StageTimer(self, name, nbytes)
+
+  def observe(self, name:str, seconds:float, nbytes:int=0, error:bool=False):
+    with self.lock:
+      stage = self.stages.get(name)
+      if stage is None:
+        stage = self.stages[name] = {
+          'count': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0, 'max': 0.0,
+          'buckets': [0] * (len(self.buckets) + 1),
+        }
+      stage['count'] += 1
+      stage['errors'] += int(error)
+      stage['bytes'] += nbytes or 0
+      stage['seconds'] += seconds
+      stage['max'] = max(stage['max'], seconds)
+      stage['buckets'][bisect_left(self.buckets, seconds)] += 1
+
+  def summary(self):
+    """Returns the per-stage totals with mean latency and throughput."""
+    with self.lock:
+      stages = {name: dict(stage, buckets=list(stage['buckets'])) for name, stage in self.stages.items()}
+      started = self.started
+    for stage in stages.values():
+      stage['mean'] = stage['seconds'] / stage['count']
+      stage['per_sec'] = stage['count'] / stage['seconds'] if stage['seconds'] else None
+      stage['bytes_per_sec'] = stage['bytes'] / stage['seconds'] if stage['seconds'] else None
+    return {
+      'started': started,
+      'wall_seconds': time.time() - started,
+      'buckets': list(self.buckets),
+      'stages': stages,
+    }
+
+  def write_json(self, path, extra:dict=None):
+    summary = self.summary()
+    summary.update(extra or {})
+    write_atomic(path, json.dumps(summary, indent=2))
+
+  def prometheus_text(self, labels:dict=None, prefix:str='gcp_ingest'):
+    summary = self.summary()
+    base = ''.join(f',{key}="{escape_label(value)}"' for key, value in sorted((labels or {}).items()))
+    lines = [
+      f'# HELP {prefix}_stage_seconds Time spent per ingest stage.',
+      f'# TYPE {prefix}_stage_seconds histogram',
+    ]
+    for name, stage in sorted(summary['stages'].items()):
+      stage_labels = f'stage="{escape_label(name)}"{base}'
+      cumulative = 0
+      for bound, count in zip(self.buckets + ('+Inf',), stage['buckets']):
+        cumulative += count
+        lines.append(f'{prefix}_stage_seconds_bucket{{{stage_labels},le="{bound}"}} {cumulative}')
+      lines.append(f'{prefix}_stage_seconds_sum{{{stage_labels}}} {stage["seconds"]}')
+      lines.append(f'{prefix}_stage_seconds_count{{{stage_labels}}} {stage["count"]}')
+    for metric, key, help_text in (
+        ('stage_bytes_total', 'bytes', 'Bytes handled per ingest stage.'),
+        ('stage_errors_total', 'errors', 'Failed passes per ingest stage.'),
+      ):
+      lines.append(f'# HELP {prefix}_{metric} {help_text}')
+      lines.append(f'# TYPE {prefix}_{metric} counter')
+      for name, stage in sorted(summary['stages'].items()):
+        lines.append(f'{prefix}_{metric}{{stage="{escape_label(name)}"{base}}} {stage[key]}')
+    lines.append(f'# HELP {prefix}_last_run_timestamp_seconds End of the last ingest run.')
+    lines.append(f'# TYPE {prefix}_last_run_timestamp_seconds gauge')
+    run_labels = f'{{{base[1:]}}}' if base else ''
+    lines.append(f'{prefix}_last_run_timestamp_seconds{run_labels} {time.time():.0f}')
+    return '\n'.join(lines) + '\n'
+
+  def write_prometheus(self, path, labels:dict=None):
+    # the textfile collector may read at any moment, never show it a partial file
+    write_atomic(path, self.prometheus_text(labels))
+
+def escape_label(value) -> str:
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+@contextmanager
+def atomic_open(path, mode:str='w'):
+  """Opens a temp file of its own next to path and moves it over path
+  when the block completes, so readers never see a partial file and
+  concurrent writers (threads, batch processes) never share a temp file.
+  The file is left alone if the block raises."""
+  path = Path(path)
+  path.parent.mkdir(parents=True, exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+  try:
+    # mkstemp files are private, these are read by other users and exporters
+    os.fchmod(fd, 0o644)
+    with os.fdopen(fd, mode) as f:
+      yield f
+    os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.unlink(tmp_path)
+    raise
+
+def write_atomic(path, text:str):
+  with atomic_open(path) as f:
+    f.write(text)
+
+# shared by every module of a run
+metrics = Metrics()
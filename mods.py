@@ -0,0 +1,105 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from xml.etree import ElementTree
+from metrics import metrics
+
+MODS_NAMESPACE = '{http://www.loc.gov/mods/v3}'
+
+def mods_name(filename) -> str:
+  return f'{str(filename).strip()}.mods.xml'
+
+def planned_mods_names(data):
+  """Returns the MODS file names needed by the parented data, in plan order."""
+  names = {}
+  for item in data:
+    if not item:
+      continue
+    names[mods_name(item['filename'])] = None
+    for child in item.get('children', []):
+      if child:
+        names[mods_name(child['filename'])] = None
+  return list(names)
+
+def validate_mods(path):
+  """Reads and parses one MODS file, returns (name, text, error)."""
+  path = Path(path)
+  try:
+    with open(path, 'r') as mods_file:
+      text = mods_file.read()
+    root = ElementTree.fromstring(text)
+  except (OSError, UnicodeDecodeError, ElementTree.ParseError) as e:
+    return path.name, None, str(e)
+  if root.tag not in (f'{MODS_NAMESPACE}mods', 'mods'):
+    return path.name, None, f"root element is {root.tag}, not mods"
+  return path.name, text, None
+
+class ModsPreflight:
+  """Checks every MODS file of an ingest plan before anything is uploaded.
+
+  MODS_DIR is listed once and cross-referenced with the plan, then the
+  planned files are parsed in a process pool. The validated text is kept
+  so ingest_files doesn't read the files again."""
+
+  def __init__(self, mods_dir):
+    self.mods_dir = Path(mods_dir)
+    self.texts = {}
+    self.missing = []
+    self.invalid = {}
+
+  def run(self, data, processes:int=None):
+    names = planned_mods_names(data)
+    with os.scandir(self.mods_dir) as it:
+      available = {entry.name for entry in it}
+    self.missing = [name for name in names if name not in available]
+    paths = [self.mods_dir.joinpath(name) for name in names if name in available]
+    logging.info(f"Validating {len(paths)} MODS files, {len(self.missing)} missing")
+
+    with metrics.stage('mods_preflight') as timer, ProcessPoolExecutor(max_workers=processes) as pool:
+      chunksize = max(1, len(paths) // ((processes or os.cpu_count() or 1) * 4))
+      for name, text, error in pool.map(validate_mods, paths, chunksize=chunksize):
+        if error:
+          self.invalid[name] = error
+        else:
+          self.texts[name] = text
+          timer.bytes += len(text)
+    return self
+
+  @property
+  def ok(self):
+    return not self.missing and not self.invalid
+
+  def bad_names(self):
+    return set(self.missing) | set(self.invalid)
+
+  def log_problems(self):
+    for name in self.missing:
+      logging.warning(f"mods {name} does not exist")
+    for name, error in self.invalid.items():
+      logging.warning(f"mods {name} is not valid: {error}")
+
+  def text(self, mods_path):
+    """Returns the validated text of mods_path, None if it wasn't preflighted."""
+    return self.texts.get(Path(mods_path).name)
+
+def drop_bad_items(data, bad_names):
+  """Removes items whose MODS failed preflight; a parent takes its
+  children with it."""
+  kept = []
+  for item in data:
+    if not item:
+      continue
+    if mods_name(item['filename']) in bad_names:
+      logging.warning(f"skipping {item['filename']}, its MODS failed preflight")
+      continue
+    if 'children' in item and not item.get('pid'):
+      children = []
+      for child in item['children']:
+        if child and mods_name(child['filename']) in bad_names:
+          logging.warning(f"skipping {child['filename']}, its MODS failed preflight")
+          continue
+        children.append(child)
+      item = dict(item, children=children)
+    kept.append(item)
+  return kept
@@ -0,0 +1,69 @@
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+WINDOWS_SEPARATORS = re.compile(r'[\\/]+')
+
+def split_windows_path(windows_path:str):
+  return [part for part in WINDOWS_SEPARATORS.split(windows_path.strip()) if part]
+
+class PathTranslator:
+  """Translates Windows paths from the sheets to paths under the mounts.
+
+  Mount roots are kept in a trie of Windows path components, matched
+  case-insensitively like Windows does; the deepest match wins. A drive
+  with no configured mount falls back to <mntdir>/<drive letter>.
+  Resolved paths are kept in a bounded LRU, so memory stays flat however
+  many rows a sheet has."""
+
+  def __init__(self, mntdir='/mnt', mounts:dict=None, max_cached:int=4096):
+    self.mntdir = Path(mntdir)
+    self.trie = {}
+    self.max_cached = max_cached
+    self.resolved = OrderedDict()
+    for windows_prefix, mount_root in (mounts or {}).items():
+      self.add_mount(windows_prefix, mount_root)
+
+  def add_mount(self, windows_prefix:str, mount_root):
+    """Maps windows_prefix (e.g. 'X:\\share') and everything below it to mount_root."""
+    node = self.trie
+    for part in split_windows_path(windows_prefix):
+      node = node.setdefault(part.casefold(), {})
+    node[None] = Path(mount_root)
+    self.resolved.clear()
+
+  def translate(self, windows_path:str) -> Path:
+    if windows_path in self.resolved:
+      self.resolved.move_to_end(windows_path)
+      return self.resolved[windows_path]
+
+    parts = split_windows_path(windows_path)
+    if not parts:
+      raise ValueError(f"empty windows path {windows_path!r}")
+    node = self.trie
+    mount_root, depth = None, 0
+    for i, part in enumerate(parts):
+      node = node.get(part.casefold())
+      if node is None:
+        break
+      if None in node:
+        mount_root, depth = node[None], i + 1
+
+    if mount_root is None:
+      drive = parts[0]
+      if len(drive) != 2 or drive[1] != ':':
+        raise ValueError(f"no mount configured for {windows_path!r}")
+      mount_root, depth = self.mntdir.joinpath(drive[0].lower()), 1
+    path = mount_root.joinpath(*parts[depth:])
+
+    self.resolved[windows_path] = path
+    if len(self.resolved) > self.max_cached:
+      self.resolved.popitem(last=False)
+    return path
+
+def parse_mount(value:str):
+  """Parses a 'WINDOWS_PREFIX=MOUNT_ROOT' command line value."""
+  windows_prefix, sep, mount_root = value.partition('=')
+  if not sep or not windows_prefix or not mount_root:
+    raise ValueError(f"expected WINDOWS_PREFIX=MOUNT_ROOT, got {value!r}")
+  return windows_prefix, mount_root
@@ -0,0 +1,115 @@
+"""Resolved ingest plans as JSON lines.
+
+The first line is a header, every following line one object to create:
+
+  {"plan": 1, "collection": "bdr:123", "mods_dir": "/mods", "source": "delivery.xlsx", ...}
+  {"role": "parent", "filename": "gcp01", "mods": "/mods/gcp01.mods.xml"}
+  {"role": "child", "filename": "gcp01", "path": "/mnt/p/a/gcp01.pdf", "size": 1024,
+   "mods": "/mods/gcp01.mods.xml", "relationship": "isPartOf", "drive": "P", "parent": "gcp01"}
+  {"role": "child", "filename": "gcp07", ..., "parent_pid": "bdr:456"}
+
+A child names the filename of the parent it belongs to, which comes
+earlier in the file, or the pid of a parent ingested before.
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from mods import mods_name
+from metrics import atomic_open
+
+PLAN_VERSION = 1
+
+def child_entry(child, mods_dir:Path, **parent):
+  filepath = child.get('filepath')
+  try:
+    size = os.stat(filepath).st_size if filepath else None
+  except OSError:
+    size = None
+  return {
+    'role': 'child',
+    'filename': child['filename'],
+    'path': str(filepath) if filepath else None,
+    'size': size,
+    'mods': str(mods_dir.joinpath(mods_name(child['filename']))),
+    'relationship': child.get('relationship'),
+    'drive': child.get('drive'),
+    **parent,
+  }
+
+def plan_entries(data, mods_dir):
+  """Flattens parented data into plan entries, in ingest order."""
+  mods_dir = Path(mods_dir)
+  for item in data:
+    if not item:
+      continue
+    if item.get('pid'):
+      # a new child of a parent ingested before
+      yield child_entry(item, mods_dir, parent_pid=item['pid'])
+      continue
+    yield {
+      'role': 'parent',
+      'filename': item['filename'],
+      'mods': str(mods_dir.joinpath(mods_name(item['filename']))),
+    }
+    for child in item.get('children', []):
+      if child:
+        yield child_entry(child, mods_dir, parent=item['filename'])
+
+def write_plan(path, data, mods_dir, collection:str, source=None):
+  """Writes the parented data as a plan, returns the number of entries."""
+  path = Path(path)
+  header = {
+    'plan': PLAN_VERSION,
+    'collection': collection,
+    'mods_dir': str(mods_dir),
+    'source': str(source) if source else None,
+    'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'unresolved': sum(
+      1 for item in data for entry in [item, *(item.get('children', []) if item else [])] if not entry
+    ),
+  }
+  count = 0
+  with atomic_open(path) as f:
+    f.write(json.dumps(header) + '\n')
+    for entry in plan_entries(data, mods_dir):
+      f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+      count += 1
+  logging.info(f"Wrote plan of {count} objects to {path}, {header['unresolved']} rows unresolved")
+  return count
+
+def read_plan(path):
+  """Returns (header, parented data) of a plan written by write_plan."""
+  with open(path, 'r') as f:
+    header = json.loads(f.readline())
+    if header.get('plan') != PLAN_VERSION:
+      raise ValueError(f"{path} is not a version {PLAN_VERSION} ingest plan")
+    data = []
+    parents = {}
+    for line_number, line in enumerate(f, 2):
+      if not line.strip():
+        continue
+      entry = json.loads(line)
+      if entry['role'] == 'parent':
+        parent = {'filename': entry['filename'], 'filepath': None, 'children': []}
+        parents[entry['filename']] = parent
+        data.append(parent)
+        continue
+      child = {
+        'filepath': Path(entry['path']) if entry['path'] else None,
+        'filename': entry['filename'],
+        'relationship': entry['relationship'],
+        # the scheduler orders by these without touching the shares
+        'size': entry.get('size'),
+        'drive': entry.get('drive'),
+      }
+      if entry.get('parent_pid'):
+        child.update({'pid': entry['parent_pid'], 'children': []})
+        data.append(child)
+      elif entry.get('parent') in parents:
+        parents[entry['parent']]['children'].append(child)
+      else:
+        raise ValueError(f"{path} line {line_number}: parent {entry.get('parent')} of {entry['filename']} is not planned before it")
+  logging.info(f"Read plan of {len(data)} items from {path}, made {header['created']} from {header['source']}")
+  return header, data
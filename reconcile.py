@@ -0,0 +1,105 @@
+import logging
+from bdr_client import solr_docs
+from journal import PARENT, CHILD
+
+# every relation dict_from_row gives a child points at its parent
+PARENT_FIELDS = ('rel_is_part_of_ssim', 'rel_is_translation_of_ssim', 'rel_is_transcript_of_ssim')
+REPOSITORY_FIELDS = ('pid', 'mods_id_filename_ssim', 'identifierFileName', *PARENT_FIELDS)
+
+def solr_quote(value) -> str:
+  return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+class RepositoryIndex:
+  """Every object of a collection, indexed by filename, from paged
+  bulk Solr queries. Lookups never go back to Solr."""
+
+  def __init__(self, solr_url:str, collection:str):
+    self.solr_url = solr_url
+    self.collection = collection
+    # filename -> [(pid, parent pids)]
+    self.objects = {}
+
+  def load(self, client=None):
+    params = {'q': f'rel_is_member_of_collection_ssim:{solr_quote(self.collection)}'}
+    count = 0
+    for doc in solr_docs(self.solr_url, params, fl=REPOSITORY_FIELDS, rows=1000, client=client):
+      count += 1
+      names = set(doc.get('mods_id_filename_ssim', []))
+      if doc.get('identifierFileName'):
+        names.add(doc['identifierFileName'])
+      parents = tuple(parent for field in PARENT_FIELDS for parent in doc.get(field, []))
+      for name in names:
+        self.objects.setdefault(str(name).strip(), []).append((doc['pid'], parents))
+    logging.info(f"Indexed {count} objects of {self.collection} under {len(self.objects)} filenames")
+    return self
+
+  def top_level_pids(self, filename):
+    return [pid for pid, parents in self.objects.get(filename, []) if not parents]
+
+  def child_pids(self, filename, parent_pid):
+    return [pid for pid, parents in self.objects.get(filename, []) if parent_pid in parents]
+
+class Reconciliation:
+  """Plan items already in the repository.
+
+  A parent that exists is not created again, its pid is reused for the
+  children still missing; children that exist under their parent are
+  skipped. A parent filename matching more than one top level object is
+  left out entirely rather than guessed."""
+
+  def __init__(self, index:RepositoryIndex):
+    self.index = index
+    # result dicts, shaped like the executor's, of the items found
+    self.existing = []
+    self.ambiguous = []
+
+  def found(self, filename, pid, role, parent_pid=None):
+    self.existing.append({
+      'filename': filename,
+      'pid': pid,
+      'parent_pid': parent_pid,
+      'error': None,
+      'role': role,
+    })
+
+  def missing_children(self, children, parent_pid):
+    """Returns the children not yet under parent_pid, as items naming that pid."""
+    missing = []
+    for child in children:
+      if not child:
+        continue
+      pids = self.index.child_pids(child['filename'], parent_pid)
+      if pids:
+        self.found(child['filename'], pids[0], CHILD, parent_pid)
+        continue
+      missing.append(dict(child, pid=parent_pid, children=[]))
+    return missing
+
+  def run(self, data):
+    """Returns the parented data without the items found in the repository."""
+    kept = []
+    for item in data:
+      if not item:
+        continue
+      if item.get('pid'):
+        kept.extend(self.missing_children([item], item['pid']))
+        continue
+      pids = self.index.top_level_pids(item['filename'])
+      if not pids:
+        kept.append(item)
+        continue
+      if len(pids) > 1:
+        logging.warning(f"{item['filename']} matches {len(pids)} objects in the repository: {pids}, skipping it")
+        self.ambiguous.append(item['filename'])
+        continue
+      self.found(item['filename'], pids[0], PARENT)
+      kept.extend(self.missing_children(item.get('children', []), pids[0]))
+    self.log_report(kept)
+    return kept
+
+  def log_report(self, kept):
+    parents = len([result for result in self.existing if result['role'] == PARENT])
+    logging.info(
+      f"Reconciled with the repository: {parents} parents and {len(self.existing) - parents} children "
+      f"exist already, {len(self.ambiguous)} ambiguous, {len(kept)} items left to ingest"
+    )
@@ -0,0 +1,193 @@
+import logging
+import os
+import time
+from collections import deque
+from pathlib import Path
+
+PROGRESS_INTERVAL = 30
+
+def mount_name(mount) -> str:
+  """Drive letters are matched like Windows does, 'x:' is 'X'."""
+  return str(mount).rstrip(':').upper()
+
+def parse_mount_limit(value:str):
+  """Parses a 'DRIVE=READERS' command line value."""
+  mount, sep, limit = value.partition('=')
+  if not sep or not mount or not limit.strip().isdigit():
+    raise ValueError(f"expected DRIVE=READERS, got {value!r}")
+  return mount_name(mount), int(limit)
+
+def mount_key(child) -> str:
+  """The share a child is read from: the drive of its sheet path, or the
+  top of its mount path for plans made before drives were recorded."""
+  if child.get('drive'):
+    return mount_name(child['drive'])
+  parts = Path(child.get('filepath') or '').parts
+  return str(Path(*parts[:3])) if parts else ''
+
+def child_size(child, stat:bool=True) -> int:
+  """The size recorded in the plan, else stat'ed when stat is set, else None."""
+  if child.get('size') is not None:
+    return child['size']
+  if not stat:
+    return None
+  try:
+    return os.stat(child['filepath']).st_size if child.get('filepath') else 0
+  except OSError:
+    # ingest_files reports the missing file
+    return 0
+
+class ChildScheduler:
+  """Orders the children waiting to be ingested by mount and size.
+
+  Each mount reads at most its cap of files at once. With large_file,
+  large files (at least large_file bytes) get up to large_slots of the
+  running slots, small files fill the rest, so one huge master doesn't
+  hold back a queue of PDFs and the small ones don't starve the big ones
+  either. Within those rules the oldest waiting child goes first.
+
+  Progress and an ETA are logged as children finish, from the bytes
+  remaining when every size is known and from the files remaining
+  otherwise. Files are only stat'ed for their size with large_file, a
+  plan records them for free."""
+
+  def __init__(self, mount_readers:int=None, mount_limits:dict=None, large_file:int=None, large_slots:int=1):
+    self.mount_readers = mount_readers
+    self.mount_limits = {mount_name(mount): max(1, limit) for mount, limit in (mount_limits or {}).items()}
+    self.large_file = large_file
+    self.large_slots = max(1, large_slots)
+    # (mount, large) -> deque of (sequence, child, parent_pid, size)
+    self.queues = {}
+    self.sequence = 0
+    self.active = {}
+    self.active_large = 0
+    self.running = {}
+    self.sizes = {}
+    self.total_files = self.done_files = 0
+    self.total_bytes = self.done_bytes = 0
+    # children counted without a size, the ETA falls back to files
+    self.unsized = 0
+    self.started = time.monotonic()
+    self.last_report = self.started
+
+  def cap(self, mount) -> int:
+    limit = self.mount_limits.get(mount_name(mount), self.mount_readers)
+    return max(1, limit) if limit else None
+
+  def count(self, child):
+    size = self.sizes[id(child)] = child_size(child, stat=self.large_file is not None)
+    self.total_files += 1
+    if size is None:
+      self.unsized += 1
+    else:
+      self.total_bytes += size
+    return size
+
+  def expect(self, data):
+    """Counts every child of the parented data up front, for the ETA."""
+    for item in data:
+      if not item:
+        continue
+      for child in [item] if item.get('pid') else item.get('children', []):
+        if child:
+          self.count(child)
+    if self.unsized:
+      logging.info(f"Scheduling {self.total_files} files")
+    else:
+      logging.info(f"Scheduling {self.total_files} files, {self.total_bytes / 1024**3:.2f} GiB")
+
+  def large(self, size) -> bool:
+    return self.large_file is not None and size is not None and size >= self.large_file
+
+  def add(self, child, parent_pid):
+    if id(child) in self.sizes:
+      size = self.sizes[id(child)]
+    else:
+      size = self.count(child)
+    key = (mount_key(child), self.large(size))
+    self.queues.setdefault(key, deque()).append((self.sequence, child, parent_pid, size))
+    self.sequence += 1
+
+  def drop(self, child):
+    """Forgets a child that will never run, its parent failed."""
+    if id(child) not in self.sizes:
+      return
+    size = self.sizes.pop(id(child))
+    self.total_files -= 1
+    if size is None:
+      self.unsized -= 1
+    else:
+      self.total_bytes -= size
+
+  def pending(self) -> int:
+    return sum(len(queue) for queue in self.queues.values())
+
+  def pop(self):
+    """Returns the next (child, parent_pid) allowed to start, None if
+    every waiting child is held back by its mount cap."""
+    best = None
+    fallback = None
+    for (mount, large), queue in self.queues.items():
+      if not queue:
+        continue
+      cap = self.cap(mount)
+      if cap and self.active.get(mount, 0) >= cap:
+        continue
+      if large and self.active_large >= self.large_slots:
+        # only when nothing small can run, rather than leave the slot idle
+        if fallback is None or queue[0][0] < fallback[0][0]:
+          fallback = queue
+        continue
+      if best is None or queue[0][0] < best[0][0]:
+        best = queue
+    queue = best or fallback
+    if queue is None:
+      return None
+    _, child, parent_pid, size = queue.popleft()
+    mount = mount_key(child)
+    self.active[mount] = self.active.get(mount, 0) + 1
+    large = self.large(size)
+    self.active_large += int(large)
+    self.running[id(child)] = (mount, large, size)
+    return child, parent_pid
+
+  def finished(self, child):
+    entry = self.running.pop(id(child), None)
+    if entry is None:
+      return
+    mount, large, size = entry
+    self.active[mount] -= 1
+    self.active_large -= int(large)
+    self.done_files += 1
+    self.done_bytes += size or 0
+    now = time.monotonic()
+    if now - self.last_report >= PROGRESS_INTERVAL or self.done_files == self.total_files:
+      self.last_report = now
+      self.log_progress(now)
+
+  def eta(self, now=None):
+    """Seconds until the bytes (or files, when some sizes are unknown)
+    still waiting or running are done, at the throughput so far; None
+    before anything finished."""
+    elapsed = (now or time.monotonic()) - self.started
+    done, total = (self.done_files, self.total_files) if self.unsized else (self.done_bytes, self.total_bytes)
+    if not done or not elapsed:
+      return None
+    return (total - done) / (done / elapsed)
+
+  def log_progress(self, now=None):
+    now = now or time.monotonic()
+    elapsed = now - self.started
+    eta = self.eta(now)
+    eta_text = 'unknown'
+    if eta is not None:
+      minutes, seconds = divmod(int(eta), 60)
+      eta_text = f'{minutes // 60}:{minutes % 60:02d}:{seconds:02d}'
+    if self.unsized:
+      logging.info(f"{self.done_files}/{self.total_files} files, ETA {eta_text}")
+      return
+    rate = self.done_bytes / elapsed if elapsed else 0
+    logging.info(
+      f"{self.done_files}/{self.total_files} files, {self.done_bytes / 1024**3:.2f}/"
+      f"{self.total_bytes / 1024**3:.2f} GiB, {rate / 1024**2:.1f} MiB/s, ETA {eta_text}"
+    )
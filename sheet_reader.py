@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import pickle
+from pathlib import Path
+from openpyxl import load_workbook
+from metrics import atomic_open
+
+DEFAULT_CACHE_DIR = Path.home().joinpath('.cache', 'gcp_ingest', 'sheets')
+CACHE_VERSION = 1
+
+def get_sheet_names(filepath):
+  workbook = load_workbook(filepath, read_only=True)
+  try:
+    return workbook.sheetnames
+  finally:
+    workbook.close()
+
+def make_headers(header_row):
+  """Names columns the way pandas.read_excel does: empty headers become
+  'Unnamed: <i>' and repeated headers get a '.<n>' suffix."""
+  headers = []
+  seen = {}
+  for i, value in enumerate(header_row):
+    header = value if value is not None and value != '' else f'Unnamed: {i}'
+    if header in seen:
+      seen[header] += 1
+      header = f'{header}.{seen[header]}'
+    else:
+      seen[header] = 0
+    headers.append(header)
+  return headers
+
+def iter_sheet_values(filepath, sheet_name):
+  """Yields the header list, then the value tuple of every non-empty row,
+  read lazily with openpyxl read-only rows."""
+  workbook = load_workbook(filepath, read_only=True, data_only=True)
+  try:
+    rows = workbook[sheet_name].iter_rows(values_only=True)
+    yield make_headers(next(rows, ()))
+    for values in rows:
+      if all(value is None or value == '' for value in values):
+        continue
+      yield values
+  finally:
+    workbook.close()
+
+def iter_sheet_rows(filepath, sheet_name):
+  """Yields the header list, then one dict per non-empty row.
+  Empty cells are returned as ''. Cells past the header row get new
+  'Unnamed' headers, appended to the already yielded header list."""
+  values_iter = iter_sheet_values(filepath, sheet_name)
+  headers = next(values_iter)
+  yield headers
+  width = len(headers)
+  for values in values_iter:
+    if len(values) > width:
+      headers.extend(f'Unnamed: {i}' for i in range(width, len(values)))
+      width = len(values)
+    row = dict.fromkeys(headers, '')
+    for header, value in zip(headers, values):
+      if value is not None:
+        row[header] = value
+    yield row
+
+def read_sheet(filepath, sheet_name):
+  """Reads a whole sheet, returns (headers, rows).
+  Unnamed columns that are empty in every row are dropped. Grouping needs
+  every row, so the sheet is held once as value tuples while it streams
+  in, and each row dict is built only for the columns kept."""
+  values_iter = iter_sheet_values(filepath, sheet_name)
+  headers = next(values_iter)
+  raw = []
+  # columns holding a value in some row
+  used = set()
+  for values in values_iter:
+    raw.append(values)
+    used.update(i for i, value in enumerate(values) if value is not None and value != '')
+  width = max([len(headers), *(len(values) for values in raw)])
+  headers.extend(f'Unnamed: {i}' for i in range(len(headers), width))
+  keep = [
+    (i, header) for i, header in enumerate(headers)
+    if i in used or not str(header).startswith('Unnamed: ')
+  ]
+  rows = []
+  raw.reverse()
+  while raw:
+    # the tuples are dropped as their dicts are built
+    values = raw.pop()
+    rows.append({
+      header: values[i] if i < len(values) and values[i] is not None else ''
+      for i, header in keep
+    })
+  return [header for _, header in keep], rows
+
+def workbook_hash(filepath):
+  digest = hashlib.sha256()
+  with open(filepath, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024**2), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+def load_sheet(filepath, sheet_name, cache_dir=DEFAULT_CACHE_DIR):
+  """Returns (headers, rows) for a sheet, from the on-disk cache when the
+  same workbook content and sheet were read before."""
+  if not cache_dir:
+    return read_sheet(filepath, sheet_name)
+
+  cache_key = hashlib.sha256(f'{workbook_hash(filepath)}:{sheet_name}'.encode()).hexdigest()
+  cache_path = Path(cache_dir).joinpath(f'{cache_key}.pickle')
+  if cache_path.exists():
+    try:
+      with open(cache_path, 'rb') as f:
+        cached = pickle.load(f)
+      if cached['version'] == CACHE_VERSION:
+        logging.info(f"Loaded sheet {sheet_name} from cache {cache_path.name}")
+        return cached['headers'], cached['rows']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError) as e:
+      logging.warning(f"Could not read sheet cache {cache_path}: {e}")
+
+  logging.info(f"Reading sheet {sheet_name} from {Path(filepath).name}")
+  headers, rows = read_sheet(filepath, sheet_name)
+  with atomic_open(cache_path, 'wb') as f:
+    pickle.dump(
+      {'version': CACHE_VERSION, 'headers': headers, 'rows': rows},
+      f,
+      protocol=pickle.HIGHEST_PROTOCOL
+    )
+  return headers, rows
@@ -0,0 +1,197 @@
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from metrics import metrics
+from bdr_client import RateLimiter
+from fixity import hash_file, hash_copy_file
+
+# linux ioctl to share extents between files (btrfs, xfs, ...)
+FICLONE = 0x40049409
+COPY_CHUNK = 1024**3
+METERED_CHUNK = 16 * 1024**2
+# errors meaning "this strategy isn't available here", try the next one
+UNSUPPORTED_ERRNOS = {
+  errno.EXDEV, errno.EPERM, errno.EACCES, errno.ENOTSUP, errno.EOPNOTSUPP,
+  errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EMLINK, errno.EBADF,
+}
+
+SIZE_UNITS = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+def parse_size(size:str) -> int:
+  """Parses a byte count like '500M' or '2T' (powers of 1024)."""
+  size = str(size).strip().upper().rstrip('B')
+  if size and size[-1] in SIZE_UNITS:
+    return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+  return int(size)
+
+def get_staging_dir():
+  return Path(os.environ['STAGING_DIR'])
+
+# links and reflinks read no data, copies charge every chunk to the limiter
+def link_file(srcpath:Path, newpath:Path, limiter:RateLimiter=None):
+  if os.stat(srcpath).st_dev != os.stat(newpath.parent).st_dev:
+    raise OSError(errno.EXDEV, "different filesystems")
+  os.link(srcpath, newpath)
+
+def reflink_file(srcpath:Path, newpath:Path, limiter:RateLimiter=None):
+  with open(srcpath, 'rb') as src, open(newpath, 'wb') as dst:
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def kernel_copy_file(srcpath:Path, newpath:Path, limiter:RateLimiter=None):
+  """Copies without passing the data through userspace."""
+  with open(srcpath, 'rb') as src, open(newpath, 'wb') as dst:
+    remaining = os.fstat(src.fileno()).st_size
+    copy = getattr(os, 'copy_file_range', None)
+    # metered copies go in small steps, so the ceiling holds within a file
+    step = METERED_CHUNK if limiter else COPY_CHUNK
+    while remaining > 0:
+      try:
+        if copy:
+          sent = copy(src.fileno(), dst.fileno(), min(remaining, step))
+        else:
+          sent = os.sendfile(dst.fileno(), src.fileno(), None, min(remaining, step))
+      except OSError as e:
+        # copy_file_range can refuse some filesystem pairs, sendfile usually won't
+        if copy and e.errno in UNSUPPORTED_ERRNOS and dst.tell() == 0:
+          copy = None
+          continue
+        raise
+      if sent == 0:
+        break
+      if limiter:
+        limiter.wait(sent)
+      remaining -= sent
+
+def user_copy_file(srcpath:Path, newpath:Path, limiter:RateLimiter=None):
+  if not limiter:
+    shutil.copyfile(srcpath, newpath)
+    return
+  with open(srcpath, 'rb') as src, open(newpath, 'wb') as dst:
+    while True:
+      chunk = src.read(METERED_CHUNK)
+      if not chunk:
+        break
+      limiter.wait(len(chunk))
+      dst.write(chunk)
+
+# cheapest first
+STAGING_STRATEGIES = [
+  ('hardlink', link_file),
+  ('reflink', reflink_file),
+  ('kernel copy', kernel_copy_file),
+  ('copy', user_copy_file),
+]
+# with fixity the copy has to pass through userspace to be digested;
+# linked files are digested with one read afterwards
+FIXITY_STRATEGIES = [
+  ('hardlink', link_file),
+  ('reflink', reflink_file),
+  ('digesting copy', hash_copy_file),
+]
+
+def stage_file(srcpath, staging_dir=None, algorithms=(), limiter:RateLimiter=None):
+  """Places srcpath into the staging dir, returns (staged path, digests).
+  Tries a hardlink, a reflink and a kernel-side copy before falling back
+  to a plain copy. With fixity algorithms the file is digested in the
+  same pass as the copy, digests maps each algorithm to its hex digest.
+  Every byte read goes through limiter when given.
+  Each file gets its own directory in the staging dir, so files of the
+  same name staged at once (by workers, prefetch or batch processes)
+  never collide; unstage removes both."""
+  srcpath = Path(srcpath)
+  if not srcpath.exists():
+    logging.error(f"path {srcpath} doesn't exist")
+    raise FileNotFoundError(srcpath)
+  staging_dir = Path(staging_dir) if staging_dir else get_staging_dir()
+  size = srcpath.stat().st_size
+  item_dir = Path(tempfile.mkdtemp(dir=staging_dir, prefix='.stage-'))
+  # mkdtemp is private to us, the API has to read the file like the staging dir
+  os.chmod(item_dir, staging_dir.stat().st_mode & 0o777)
+  newpath = item_dir.joinpath(srcpath.name)
+
+  strategies = FIXITY_STRATEGIES if algorithms else STAGING_STRATEGIES
+  try:
+    with metrics.stage('stage', size):
+      for i, (strategy, stage) in enumerate(strategies):
+        start = time.monotonic()
+        try:
+          if stage is hash_copy_file:
+            digests = stage(srcpath, newpath, algorithms, limiter)
+          else:
+            stage(srcpath, newpath, limiter)
+            digests = hash_file(newpath, algorithms, limiter) if algorithms else {}
+        except OSError as e:
+          if newpath.exists():
+            newpath.unlink()
+          if e.errno not in UNSUPPORTED_ERRNOS or i == len(strategies) - 1:
+            raise
+          logging.debug(f"{strategy} not possible for {srcpath.name}: {e}")
+          continue
+        elapsed = time.monotonic() - start
+        rate = size / elapsed if elapsed else float('inf')
+        logging.info(f"staged {srcpath.name} by {strategy}: {size} bytes in {elapsed:.2f}s ({rate / 1024**2:.1f} MiB/s)")
+        return newpath, digests
+  except BaseException:
+    shutil.rmtree(item_dir, ignore_errors=True)
+    raise
+
+def unstage(path:Path):
+  """Removes a file placed by stage_file and its directory."""
+  path = Path(path)
+  try:
+    path.unlink()
+  except FileNotFoundError:
+    # the POST is what matters, a missing copy must not fail it
+    logging.warning(f"staged file {path} was already removed")
+  path.parent.rmdir()
+
+class StagingBudget:
+  """Limits the bytes held in the staging dir at once.
+
+  A file larger than the whole budget is still admitted when nothing else
+  is staged, so a single oversized master can't stall the run."""
+
+  def __init__(self, limit:int=None):
+    self.limit = limit
+    self.used = 0
+    self.cond = threading.Condition()
+
+  def acquire(self, size:int):
+    with self.cond:
+      while self.limit and self.used and self.used + size > self.limit:
+        logging.debug(f"waiting for staging budget: {self.used}+{size} > {self.limit}")
+        self.cond.wait()
+      self.used += size
+
+  def release(self, size:int):
+    with self.cond:
+      self.used -= size
+      self.cond.notify_all()
+
+class StagedFile:
+  """A file copied into staging ahead of its POST; digests holds its
+  fixity when algorithms were given."""
+
+  def __init__(self, srcpath, budget:StagingBudget=None, staging_dir=None, algorithms=(), limiter:RateLimiter=None):
+    self.srcpath = Path(srcpath)
+    self.budget = budget or StagingBudget()
+    self.size = self.srcpath.stat().st_size
+    self.budget.acquire(self.size)
+    try:
+      self.path, self.digests = stage_file(self.srcpath, staging_dir, algorithms, limiter)
+    except Exception:
+      self.budget.release(self.size)
+      raise
+    logging.debug(f"staged {self.srcpath.name} ({self.size} bytes)")
+
+  def release(self):
+    try:
+      unstage(self.path)
+    finally:
+      self.budget.release(self.size)
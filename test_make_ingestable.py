@@ -0,0 +1,107 @@
+"""Regression test: the single pass make_ingestable groups a sheet exactly
+like the original nested scan did.
+
+Run with `python -m pytest test_make_ingestable.py`."""
+import random
+import pandas as pd
+import pytest
+import main
+
+ROWS = 50_000
+
+def fake_dict_from_row(row, pid=None):
+  # stands in for the share lookup, keeps what decides the grouping
+  result = {'filename': str(row['identifierFileName']).strip(), 'row': row['row']}
+  if pid:
+    result.update({'pid': pid, 'children': []})
+  return result
+
+def legacy_make_ingestable(data:pd.DataFrame):
+  """make_ingestable as it was before the index, O(n²)."""
+  data_dict = data.to_dict('records')
+  data_dict.pop(0)
+  parented_data = []
+  for row in data_dict:
+    if row.get('ingestcomplete') and not row.get('pid'):
+      continue
+    if not row['identifierFileName'] or not row["filepath"]:
+      continue
+    if row['parent'] and type(row['parent']) is str:
+      continue
+    if row.get("pid"):
+      for child in data_dict:
+        if child.get('ingestcomplete'):
+          continue
+        if not child['identifierFileName']:
+          continue
+        if child['parent'] == row['identifierFileName']:
+          parented_data.append(fake_dict_from_row(child,row['pid']))
+      continue
+    parent = {
+      "filename": row['identifierFileName'],
+      "filepath": None,
+      'children': [fake_dict_from_row(row)],
+    }
+    for child in data_dict:
+      if not child['identifierFileName']:
+        continue
+      if child['parent'] == row['identifierFileName']:
+        parent['children'].append(fake_dict_from_row(child))
+    parented_data.append(parent)
+  return parented_data
+
+def synthetic_sheet(rows:int, seed:int=1) -> pd.DataFrame:
+  """Parents with 0-140 children, pid-resumed parents, completed rows, rows
+  missing a filename or path, orphans and duplicate filenames, shuffled
+  the way delivery sheets are. Blank cells are '' like check_cols reads them."""
+  rng = random.Random(seed)
+  records = [{
+    'row': 0, 'identifierFileName': 'identifierFileName', 'filepath': 'filepath',
+    'parent': 'parent', 'pid': 'pid', 'ingestcomplete': 'ingestcomplete', 'itemTitle': 'itemTitle',
+  }]
+  parent_names = []
+  while len(records) <= rows:
+    name = f'gcp{len(records):06d}'
+    if parent_names and rng.random() < 0.02:
+      # a repeated filename, matched by every parent of that name
+      name = rng.choice(parent_names)
+    parent_names.append(name)
+    records.append({
+      'identifierFileName': name,
+      'filepath': '' if rng.random() < 0.01 else f'X:\\share\\{name[:6]}',
+      'parent': '',
+      'pid': f'bdr:{len(records)}' if rng.random() < 0.05 else '',
+      'ingestcomplete': 'x' if rng.random() < 0.05 else '',
+    })
+    for _ in range(rng.randint(0, 3) if rng.random() < 0.2 else rng.randint(60, 140)):
+      records.append({
+        'identifierFileName': '' if rng.random() < 0.01 else f'{name}_{len(records)}',
+        'filepath': f'X:\\share\\{name[:6]}',
+        'parent': name if rng.random() > 0.01 else f'missing{len(records)}',
+        'pid': '',
+        'ingestcomplete': 'x' if rng.random() < 0.05 else '',
+      })
+  header, body = records[0], records[1:rows + 1]
+  rng.shuffle(body)
+  for number, record in enumerate(body, 1):
+    record.update({'row': number, 'itemTitle': f'title {number}'})
+  return pd.DataFrame([header] + body)
+
+@pytest.fixture
+def sheet(monkeypatch):
+  monkeypatch.setattr(main, 'dict_from_row', fake_dict_from_row)
+  return synthetic_sheet(ROWS)
+
+def test_grouping_matches_nested_scan(sheet):
+  expected = legacy_make_ingestable(sheet)
+  actual = main.make_ingestable(sheet)
+  # same items in the same ingest order, each parent with the same children
+  assert len(actual) == len(expected)
+  assert actual == expected
+  # check_cols hands over row dicts, not a DataFrame
+  assert main.make_ingestable(sheet.to_dict('records')) == expected
+
+def test_pid_rows_resume_their_parent(sheet):
+  resumed = [item for item in main.make_ingestable(sheet) if item.get('pid')]
+  assert resumed
+  assert all(item['children'] == [] for item in resumed)
@@ -0,0 +1,79 @@
+import logging
+import time
+import uuid
+from pathlib import Path
+from fixity import new_hashers
+from metrics import metrics
+
+# bytes of the file held in memory at once
+UPLOAD_CHUNK = 8 * 1024**2
+PROGRESS_INTERVAL = 30
+
+def quote_header(value) -> str:
+  return str(value).replace('\\', '\\\\').replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+class MultipartStream:
+  """multipart/form-data body streamed straight from the source file.
+
+  The form fields go first, then the file is read one UPLOAD_CHUNK at a
+  time, so memory stays bounded whatever the file size. Passed as data
+  to requests it is sent with chunked transfer encoding. Progress is
+  logged every PROGRESS_INTERVAL seconds, and the file is digested for
+  fixity on the way through. Each chunk read is charged to the limiter
+  (a bdr_client.RateLimiter in bytes) when given."""
+
+  def __init__(self, fields:dict, file_field:str, path, algorithms=(), limiter=None):
+    self.fields = fields
+    self.file_field = file_field
+    self.path = Path(path)
+    self.size = self.path.stat().st_size
+    self.boundary = uuid.uuid4().hex
+    self.hashers = new_hashers(algorithms)
+    self.limiter = limiter
+    self.sent = 0
+    self.digests = {}
+
+  @property
+  def content_type(self):
+    return f'multipart/form-data; boundary={self.boundary}'
+
+  def part_header(self, name, filename=None) -> bytes:
+    disposition = f'form-data; name="{quote_header(name)}"'
+    if filename:
+      disposition += f'; filename="{quote_header(filename)}"'
+    header = f'--{self.boundary}\r\nContent-Disposition: {disposition}\r\n'
+    if filename:
+      header += 'Content-Type: application/octet-stream\r\n'
+    return (header + '\r\n').encode()
+
+  def __iter__(self):
+    for name, value in self.fields.items():
+      yield self.part_header(name) + str(value).encode() + b'\r\n'
+    yield self.part_header(self.file_field, self.path.name)
+
+    start = last_report = time.monotonic()
+    with open(self.path, 'rb') as src:
+      while True:
+        chunk = src.read(UPLOAD_CHUNK)
+        if not chunk:
+          break
+        if self.limiter:
+          self.limiter.wait(len(chunk))
+        for hasher in self.hashers.values():
+          hasher.update(chunk)
+        yield chunk
+        self.sent += len(chunk)
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+          last_report = now
+          logging.info(
+            f"uploading {self.path.name}: {self.sent / 1024**2:.0f} of {self.size / 1024**2:.0f} MiB "
+            f"({self.sent / (now - start) / 1024**2:.1f} MiB/s)"
+          )
+    yield f'\r\n--{self.boundary}--\r\n'.encode()
+
+    elapsed = time.monotonic() - start
+    self.digests = {algorithm: hasher.hexdigest() for algorithm, hasher in self.hashers.items()}
+    metrics.observe('upload', elapsed, self.sent)
+    rate = self.sent / elapsed if elapsed else float('inf')
+    logging.info(f"uploaded {self.path.name}: {self.sent} bytes in {elapsed:.2f}s ({rate / 1024**2:.1f} MiB/s)")